@@ -2,10 +2,17 @@ import xml.etree.ElementTree as ET
 import libs.LidoRDFConverter as LRC
 from pathlib import Path
 from libs.x3ml_classes import X3ml
-from libs.x3ml import load_lido_map
-from flask import Flask, render_template, request,  jsonify, make_response
+from libs.x3ml import load_lido_map, Mappings
+from libs.mapping_cache import MappingCache
+from libs.metrics import Metrics
+from libs.jobs import JobQueue, QueueFull
+from flask import Flask, render_template, request,  jsonify, make_response, send_file, url_for, stream_with_context
+import io
+import itertools
 import logging
 import json
+import shutil
+import tempfile
 from dataclasses import dataclass
 
 from waitress import serve
@@ -13,6 +20,14 @@ from argparse import ArgumentParser, BooleanOptionalAction
 
 app = Flask(__name__, template_folder='templates', static_folder='static', static_url_path='/assets')
 
+METRICS = Metrics()
+MAPPING_CACHE = MappingCache(metrics=METRICS)
+JOBS = JobQueue(Path(tempfile.gettempdir()) / 'lido2rdf-jobs')
+
+FORMAT_MIMETYPES = {'turtle': 'text/turtle', 'ttl': 'text/turtle', 'nt': 'application/n-triples',
+                    'nquads': 'application/n-quads', 'xml': 'application/rdf+xml', 'pretty-xml': 'application/rdf+xml',
+                    'json-ld': 'application/ld+json', 'n3': 'text/n3', 'trig': 'application/trig', 'trix': 'application/trix'}
+
 
 def dlftMappingFile():
     return Path('./defaultMapping.x3ml')
@@ -22,17 +37,89 @@ def dlftLidoFile():
     return Path('./defaultLido.xml')
 
 
-def convert_lido_str(lido_str, x3ml_str,**kw):
-    '''Converts LIDO XML string to RDF using the provided X3ML mapping string.
+def dlftMappings():
+    '''Returns the compiled default mappings'''
+    return MAPPING_CACHE.get_file(dlftMappingFile())
+
+
+def json_mappings(js):
+    '''Returns the compiled mappings of a JSON X3ML model'''
+    return MAPPING_CACHE.get(json.dumps(js, sort_keys=True), lambda: Mappings.from_model(X3ml.fromJSON(js)))
+
+
+def sent(rdf_str: str) -> str:
+    '''Counts the bytes of an RDF response'''
+    METRICS.count('output_bytes', len(rdf_str.encode('utf-8')))
+    return rdf_str
+
+
+def convert_lido_str(lido_str, mappings, **kw):
+    '''Converts LIDO XML string to RDF using the provided X3ML mapping string or compiled mappings.
     Returns the RDF string in the specified format.'''
     if lido_str:
         format = kw.get('format','turtle')
-        converter = LRC.LidoRDFConverter.from_str(x3ml_str, **kw)
+        if not isinstance(mappings, Mappings):
+            mappings = MAPPING_CACHE.get(mappings)
+        converter = LRC.LidoRDFConverter.from_mappings(mappings, metrics=METRICS, **kw)
         graph = converter.parse_string(lido_str)
-        return graph.serialize(format=format)
+        return sent(converter.serialize(graph, format))
     return ''
 
-#############################################################################
+
+def convert_lido_chunks(chunks, mappings, **kw):
+    '''Converts LIDO XML chunks to RDF using the provided X3ML mapping string or compiled mappings.
+    Yields N-Triples/N-Quads record by record, other formats once all records are converted.'''
+    format = kw.get('format', 'turtle')
+    if not isinstance(mappings, Mappings):
+        mappings = MAPPING_CACHE.get(mappings)
+    converter = LRC.LidoRDFConverter.from_mappings(mappings, metrics=METRICS, **kw)
+    out = io.StringIO()
+    sink = LRC.make_sink(format, out)
+    for _ in converter.parse_chunks(chunks, sink):
+        if out.tell():
+            yield sent(out.getvalue())
+            out.seek(0)
+            out.truncate()
+    yield '' if format in LRC.STREAM_FORMATS else sent(converter.serialize(sink.result(), format))
+
+
+def convert_documents(documents, mappings, merge=False, **kw):
+    '''Converts (id, LIDO) documents over the same compiled mappings, yields (id, RDF string, error) per document
+
+    With merge the RDF is N-Quads with a named graph per document.
+    '''
+    format = 'nquads' if merge else kw.get('format', 'turtle')
+    if not isinstance(mappings, Mappings):
+        mappings = MAPPING_CACHE.get(mappings)
+    converter = LRC.LidoRDFConverter.from_mappings(mappings, metrics=METRICS, **kw)
+    for doc_id, lido in documents:
+        out = io.StringIO()
+        if merge:
+            sink = LRC.NTriplesSink(out, quads=True, graph=converter.nodes.graph_node(doc_id))
+        else:
+            sink = LRC.make_sink(format, out)
+        try:
+            for _ in converter.parse_chunks([lido.encode('utf-8') if isinstance(lido, str) else lido], sink):
+                pass
+            rdf = out.getvalue() if format in LRC.STREAM_FORMATS else converter.serialize(sink.result(), format)
+            yield doc_id, sent(rdf), ''
+        except Exception as e:
+            yield doc_id, '', str(e)
+
+
+def ndjson_documents(lines):
+    '''Returns the (id, LIDO) documents of NDJSON lines {"id": ..., "lido": ...}, ids default to the line index'''
+    for i, line in enumerate(lines):
+        if line.strip():
+            obj = json.loads(line)
+            yield str(obj.get('id', i)), obj['lido']
+
+
+def read_chunks(stream, size=2**16):
+    '''Returns the non-empty chunks of a stream'''
+    return iter(lambda: stream.read(size), b'')
+
+#########################################################################
 
 
 @app.route('/')
@@ -95,11 +182,10 @@ def run_mappings():
     parm = request.get_json()
     lido_data = parm.get('data','')
     if js := parm.get('x3ml'):
-        model = X3ml.fromJSON(js)
         format = parm.get('format','turtle')
         useBlankNode = parm.get('useBlankNode',True)
         response_object = {'status': 'success', 'message': 'Mappings applied to Lido!', 'format':format}
-        response_object['text'] = convert_lido_str(lido_data, model.to_str(),format=format, useBlankNode = useBlankNode)
+        response_object['text'] = convert_lido_str(lido_data, json_mappings(js), format=format, useBlankNode = useBlankNode)
         return jsonify(response_object)
     return jsonify({'status': 'failed', 'message': 'No Lido data provided!'})
 
@@ -115,22 +201,142 @@ def convert():
         if 'mapping' in request.files:
             mapping_data = request.files['mapping'].read().decode('utf-8')
         else:
-            mapping_data = dlftMappingFile().read_text()
-        lido_data = request.files['file'].read().decode('utf-8')
+            mapping_data = dlftMappings()
+        lido_stream = request.files['file'].stream
         format = request.form.get('format', 'turtle')
         useBlankNode = request.form.get('blankNode', 'false').lower() == 'true'
     else:
-        mapping_data = dlftMappingFile().read_text()
-        lido_data = request.get_data()
+        mapping_data = dlftMappings()
+        lido_stream = request.stream
         format = 'turtle'
         useBlankNode = False
+    chunks = read_chunks(lido_stream)
+    first = next(chunks, b'')
+    if not first:
+        return make_response('', 200)
+    rdf_chunks = stream_with_context(convert_lido_chunks(itertools.chain([first], chunks), mapping_data,
+                                                         format=format, useBlankNode=useBlankNode))
     try:
-        rdf_str = convert_lido_str(lido_data, mapping_data, format=format, useBlankNode = useBlankNode)
-        response = make_response(rdf_str, 200)
-        response.mime_type = f"text/{format}"
+        # Errors in the first records still get a 400, later ones end the streamed response
+        first = next(rdf_chunks)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
-    return response
+    return app.response_class(itertools.chain([first], rdf_chunks), mimetype=FORMAT_MIMETYPES.get(format, 'text/plain'))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    '''Returns the conversion metrics in the Prometheus text format'''
+    return METRICS.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@app.route('/convert/batch', methods=['POST'])
+def convert_batch():
+    '''Converts many LIDO documents over one mapping, uploaded as file parts or as NDJSON lines'''
+    # Example: curl -X POST -F file=@a.xml -F file=@b.xml -F format=nt HOST:PORT/convert/batch
+    # NDJSON: {"mapping": "<x3ml .../>"} (optional first line), then {"id": "a", "lido": "<lido:lido .../>"} per line
+    mapping_data = dlftMappings()
+    if request.mimetype == "multipart/form-data":
+        if 'mapping' in request.files:
+            mapping_data = request.files['mapping'].read().decode('utf-8')
+        documents = ((f.filename or str(i), f.read()) for i, f in enumerate(request.files.getlist('file')))
+        params = request.form
+    elif request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        lines = (line for line in request.stream if line.strip())
+        first = next(lines, b'{}')
+        try:
+            obj = json.loads(first)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not isinstance(obj, dict):
+            return jsonify({'error': "NDJSON lines must be JSON objects."}), 400
+        if 'mapping' in obj:
+            mapping_data = obj['mapping']
+        else:
+            lines = itertools.chain([first], lines)
+        documents = ndjson_documents(lines)
+        params = request.args
+    else:
+        return jsonify({'error': "Send the LIDO documents as multipart/form-data or application/x-ndjson."}), 415
+    format = params.get('format', 'turtle')
+    merge = params.get('merge', 'false').lower() == 'true'
+    useBlankNode = params.get('blankNode', 'false').lower() == 'true'
+    try:
+        results = convert_documents(documents, mapping_data, merge, format=format, useBlankNode=useBlankNode)
+        first = next(results, None)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    results = itertools.chain([first] if first else [], results)
+    if merge:
+        # Failed documents are reported as N-Quads comments
+        def merged():
+            for doc_id, rdf, error in results:
+                yield ' '.join(f'# {doc_id}: {error}'.split()) + '\n' if error else rdf
+        return app.response_class(stream_with_context(merged()), mimetype=FORMAT_MIMETYPES['nquads'])
+    try:
+        return jsonify({'format': format, 'results': [{'id': doc_id, 'status': 'failed', 'error': error} if error else
+                                                      {'id': doc_id, 'status': 'done', 'rdf': rdf}
+                                                      for doc_id, rdf, error in results]})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    '''Queues the conversion of a LIDO file, uploaded as for /convert or as request body'''
+    # Example: curl -X POST -F file=@big_lido.xml -F format=nt HOST:PORT/jobs
+    mapping_text = ''
+    if request.mimetype == "multipart/form-data":
+        if 'file' not in request.files:
+            return jsonify({'error': "No LIDO file part in the request."}), 400
+        write_input = request.files['file'].save
+        if 'mapping' in request.files:
+            mapping_text = request.files['mapping'].read().decode('utf-8')
+        params = request.form
+    else:
+        def write_input(path):
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(request.stream, f, 2**16)
+        params = request.args
+    format = params.get('format', 'turtle')
+    useBlankNode = params.get('blankNode', 'false').lower() == 'true'
+    try:
+        job = JOBS.submit(write_input, dlftMappingFile().resolve(), mapping_text, format, useBlankNode)
+    except QueueFull as ex:
+        return jsonify({'error': str(ex)}), 503, {'Retry-After': str(ex.retry_after)}
+    return jsonify(job_status_object(job)), 202, {'Location': url_for('job_status', job_id=job.id)}
+
+
+def job_status_object(job):
+    return job.to_dict() | {'status_url': url_for('job_status', job_id=job.id),
+                            'result_url': url_for('job_result', job_id=job.id)}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    if job := JOBS.get(job_id):
+        return jsonify(job_status_object(job))
+    return jsonify({'error': 'Unknown job'}), 404
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    if not (job := JOBS.get(job_id)):
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status == 'done':
+        return send_file(job.result_path(), mimetype=FORMAT_MIMETYPES.get(job.format, 'text/plain'))
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), 409
+    return jsonify(job_status_object(job)), 202, {'Retry-After': '1'}
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    if JOBS.remove(job_id):
+        return '', 204
+    if JOBS.get(job_id):
+        return jsonify({'error': 'Job is not finished'}), 409
+    return jsonify({'error': 'Unknown job'}), 404
 
 
 @dataclass
@@ -170,13 +376,18 @@ if __name__ == '__main__':
     parser.add_argument('-w', '--wsgi', action=BooleanOptionalAction, help="Use WSGI server")
     parser.add_argument('-p', '--port', type=int, default=5000, help="Server port")
     parser.add_argument('-l', '--log', action=BooleanOptionalAction, help="Use logger")
+    parser.add_argument('--job-workers', type=int, default=2, help="Worker processes of conversion jobs")
+    parser.add_argument('--job-queue', type=int, default=8, help="Waiting conversion jobs before requests are refused")
+    parser.add_argument('--job-dir', default=str(JOBS.spool_dir), help="Directory of conversion job files")
     args = parser.parse_args()
+    JOBS.workers, JOBS.max_queued, JOBS.spool_dir = args.job_workers, args.job_queue, Path(args.job_dir)
 
     if args.log:
         logging.basicConfig(filename='app.log', level=logging.INFO)
 
     get_version_data()
     load_lido_map() 
+    dlftMappings()  # pre-warm the mapping cache
 
     if args.wsgi:
         print(f"Starting WSGI server at http://localhost:{args.port}/")
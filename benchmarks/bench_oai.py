@@ -0,0 +1,41 @@
+'''Compares the throughput of sequential and pipelined OAI-PMH harvesting against a local stand-in server
+
+Usage: python -m benchmarks.bench_oai [-n RECORDS] [-p PAGE_SIZE] [-d DELAY] [-t FORMAT]
+'''
+import io
+import json
+import time
+import tempfile
+import argparse
+from contextlib import redirect_stderr
+from libs.LidoRDFConverter import LidoRDFConverter
+from tests.oai_server import OAIServer, make_record
+
+
+def records_per_sec(converter, server, records, prefetch, format) -> float:
+    '''Returns the harvest rate in records/sec'''
+    with tempfile.TemporaryDirectory() as folder, redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        converter.process_url(server.url, rdf_folder=f'{folder}/rdf', suffix=format, prefetch=prefetch)
+        return records / (time.perf_counter() - start)
+
+
+def run(records=2000, page_size=200, delay=0.2, format='nt', prefetch=2) -> dict:
+    '''Runs the harvest without (before) and with (after) pipelining'''
+    converter = LidoRDFConverter('defaultMapping.x3ml')
+    with OAIServer([make_record(i) for i in range(records)], page_size, delay) as server:
+        result = {'before': records_per_sec(converter, server, records, 0, format),
+                  'after': records_per_sec(converter, server, records, prefetch, format)}
+    result['speedup'] = result['after'] / result['before']
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pipelined OAI-PMH harvesting")
+    parser.add_argument('-n', '--records', type=int, default=2000, help="Number of records")
+    parser.add_argument('-p', '--page-size', type=int, default=200, help="Records per page")
+    parser.add_argument('-d', '--delay', type=float, default=0.2, help="Response delay of the server in seconds")
+    parser.add_argument('-t', '--type', dest='format', default='nt', help="RDF output format")
+    parser.add_argument('--prefetch', type=int, default=2, help="Pages fetched ahead")
+    args = parser.parse_args()
+    print(json.dumps(run(args.records, args.page_size, args.delay, args.format, args.prefetch), indent=2))
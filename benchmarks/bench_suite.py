@@ -0,0 +1,115 @@
+'''Measures conversion throughput and peak memory on a synthetic LIDO corpus, for comparisons between versions
+
+Each scenario runs in a fresh process, so its peak RSS is its own. With a baseline result file, scenarios
+whose rate dropped by more than the tolerance are listed as regressions and the exit status is 1.
+
+Usage: python -m benchmarks.bench_suite [-n RECORDS] [-r REPEAT] [--nesting N] [-t FORMAT] [-s SCENARIO ...]
+                                        [-o RESULT] [--baseline RESULT] [--tolerance 0.1]
+'''
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import multiprocessing
+from contextlib import redirect_stderr
+from benchmarks.lido_corpus import write_corpus
+
+SCENARIOS = ('parse_file', 'parse_string', 'convert', 'mapping_load')
+
+
+def run_scenario(scenario: str, corpus: str, mapping: str, format: str, loads: int = 20) -> dict:
+    '''Runs a scenario and returns its rates, called in a fresh process'''
+    from libs.LidoRDFConverter import LidoRDFConverter, STREAM_FORMATS, make_sink, peak_rss
+    from libs.metrics import Metrics
+    metrics = Metrics()
+    with open(os.devnull, 'w', encoding='utf-8') as out, redirect_stderr(io.StringIO()):
+        if scenario == 'mapping_load':
+            start = time.perf_counter()
+            for _ in range(loads):
+                LidoRDFConverter(mapping)
+            seconds = time.perf_counter() - start
+            return {'seconds': seconds, 'loads_per_sec': loads / seconds, 'peak_rss_mb': peak_rss() / 2**20}
+        if scenario == 'parse_file':
+            converter = LidoRDFConverter(mapping, metrics=metrics)
+            start = time.perf_counter()
+            converter.parse_to_file(corpus, os.devnull, format)
+        elif scenario == 'parse_string':
+            converter = LidoRDFConverter(mapping, metrics=metrics)
+            with open(corpus, 'rb') as f:
+                lido = f.read()
+            start = time.perf_counter()
+            if format in STREAM_FORMATS:
+                converter.parse_string(lido, make_sink(format, out))
+            else:
+                converter.serialize(converter.parse_string(lido), format, os.devnull)
+        elif scenario == 'convert':
+            import app as service
+            service.METRICS = metrics
+            client = service.app.test_client()
+            start = time.perf_counter()
+            with open(corpus, 'rb') as f:
+                response = client.post('/convert', data={'file': (f, 'corpus.xml'), 'format': format})
+                for _ in response.iter_encoded():
+                    pass
+            if response.status_code != 200:
+                raise RuntimeError(f'/convert failed with {response.status_code}')
+        else:
+            raise ValueError(f'Unknown scenario {scenario}')
+        seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'records_per_sec': metrics.counters['records'] / seconds,
+            'triples_per_sec': metrics.counters['triples'] / seconds, 'peak_rss_mb': peak_rss() / 2**20}
+
+
+def run(records=1000, repeat=1, nesting=0, format='nt', scenarios=SCENARIOS, mapping='defaultMapping.x3ml',
+        corpus=None) -> dict:
+    '''Generates a corpus (unless given) and runs the scenarios on it'''
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as folder:
+        if corpus is None:
+            corpus = f'{folder}/corpus.xml'
+            write_corpus(corpus, records, repeat=repeat, nesting=nesting)
+        result = {'corpus': {'records': records, 'repeat': repeat, 'nesting': nesting, 'bytes': os.path.getsize(corpus)},
+                  'format': format, 'scenarios': {}}
+        for scenario in scenarios:
+            with context.Pool(1) as pool:
+                result['scenarios'][scenario] = pool.apply(run_scenario, (scenario, corpus, mapping, format))
+    return result
+
+
+def regressions(result: dict, baseline: dict, tolerance: float = 0.1) -> list:
+    '''Returns the rates of the scenarios which are more than tolerance below the baseline'''
+    slower = []
+    for scenario, values in result['scenarios'].items():
+        for key, value in values.items():
+            before = baseline.get('scenarios', {}).get(scenario, {}).get(key)
+            if key.endswith('_per_sec') and before and value < before * (1 - tolerance):
+                slower.append({'scenario': scenario, 'rate': key, 'baseline': before, 'value': value})
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark LIDO conversion on a synthetic corpus")
+    parser.add_argument('-n', '--records', type=int, default=1000, help="Number of records")
+    parser.add_argument('-r', '--repeat', type=int, default=1, help="Copies of repeatable sets per record")
+    parser.add_argument('--nesting', type=int, default=0, help="Levels of lido:partOfPlace per place")
+    parser.add_argument('-t', '--type', dest='format', default='nt', help="RDF output format")
+    parser.add_argument('-s', '--scenario', dest='scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('-m', '--mapping', default='defaultMapping.x3ml', help="X3ML mapping file")
+    parser.add_argument('--corpus', help="LIDO XML file to use instead of a generated corpus")
+    parser.add_argument('-o', '--output', help="Write the result JSON to this file")
+    parser.add_argument('--baseline', help="Result JSON of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed slowdown against the baseline")
+    args = parser.parse_args()
+    result = run(args.records, args.repeat, args.nesting, args.format, args.scenarios, args.mapping, args.corpus)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            result['regressions'] = regressions(result, json.load(f), args.tolerance)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+    sys.exit(1 if result.get('regressions') else 0)
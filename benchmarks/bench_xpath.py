@@ -0,0 +1,75 @@
+'''Compares the conversion rate of string xpaths and compiled mapping plans
+
+Usage: python -m benchmarks.bench_xpath [LIDO-XML ...] [-m MAPPING] [-r REPEAT]
+'''
+import io
+import json
+import time
+import argparse
+import contextlib
+from dataclasses import dataclass
+from contextlib import redirect_stdout, redirect_stderr
+from lxml import etree
+import libs.x3ml as x3ml
+from libs.LidoRDFConverter import LidoRDFConverter, LIDO_TAG
+
+
+@dataclass
+class StringIDHost():
+    '''ID host evaluating its xpath strings on each call, like before the ID hosts were compiled'''
+    tags: list
+
+    def elements(self, elem, record=None) -> list:
+        return [e for tag in self.tags if tag for e in x3ml.attr_to_text(
+            elem, elem.xpath(f'./{tag}', namespaces=x3ml.used_namespaces), x3ml.attr_filter(tag), record)]
+
+
+@contextlib.contextmanager
+def string_id_hosts():
+    '''Replaces the compiled ID hosts of LIDO_ID_MAP by string xpaths within a with block'''
+    compiled = dict(x3ml.LIDO_ID_MAP)
+    x3ml.LIDO_ID_MAP.update({k: StringIDHost(h.tags if isinstance(h, x3ml.ID_Host_List) else [h.tag])
+                             for k, h in compiled.items()})
+    try:
+        yield
+    finally:
+        x3ml.LIDO_ID_MAP.update(compiled)
+
+
+def count_records(lido_file) -> int:
+    '''Counts the LIDO records of a file'''
+    return sum(1 for _ in etree.iterparse(lido_file, events=("end",), tag=LIDO_TAG))
+
+
+def records_per_sec(converter, lido_files, repeat) -> float:
+    '''Returns the conversion rate of a converter in records/sec'''
+    records = sum(count_records(f) for f in lido_files) * repeat
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+        for _ in range(repeat):
+            for lido_file in lido_files:
+                converter.parse_file(lido_file)
+    return records / (time.perf_counter() - start)
+
+
+def run(lido_files, mapping_file, repeat=3) -> dict:
+    '''Runs the benchmark with string xpaths of mappings and ID hosts (before) and compiled xpaths (after)'''
+    before = LidoRDFConverter(mapping_file)
+    before.mappings = x3ml.Mappings.from_file(mapping_file, compiled=False)
+    after = LidoRDFConverter(mapping_file)
+    # Warm up, the first parsed file updates the namespaces once
+    records_per_sec(after, lido_files[:1], 1)
+    with string_id_hosts():
+        result = {'before': records_per_sec(before, lido_files, repeat)}
+    result['after'] = records_per_sec(after, lido_files, repeat)
+    result['speedup'] = result['after'] / result['before']
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compiled xpaths of X3ML mappings")
+    parser.add_argument('lido_files', metavar='LIDO-XML', nargs='*', default=['example1.xml', 'example2.xml'])
+    parser.add_argument('-m', '--mapping', default='defaultMapping.x3ml', help="X3ML mapping file")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Repetitions per file")
+    args = parser.parse_args()
+    print(json.dumps(run(args.lido_files, args.mapping, args.repeat), indent=2))
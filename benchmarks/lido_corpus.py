@@ -0,0 +1,93 @@
+'''Generates deterministic synthetic LIDO corpora from a template record
+
+The ID elements named in lido-id-map.json and the rdf:about of concepts become slots: record IDs are unique
+per record, the other IDs are drawn from a vocabulary of shared values. Repeatable sets are copied repeat
+times and places get nesting levels of lido:partOfPlace.
+
+Usage: python -m benchmarks.lido_corpus OUTPUT [-n RECORDS] [-r REPEAT] [--nesting N] [--vocabulary N] [--seed N]
+'''
+import re
+import copy
+import json
+import random
+import argparse
+from lxml import etree
+
+LIDO_NS = 'http://www.lido-schema.org'
+RDF_ABOUT = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about'
+RECORD_TAGS = {'lido:lidoRecID', 'lido:recordID', 'lido:workID', 'lido:objectID'}
+'''ID elements unique per record'''
+REPEATED_TAGS = ('lido:eventSet', 'lido:eventActor', 'lido:subjectSet')
+SLOT = '@@slot{}@@'
+SLOT_PATTERN = re.compile(SLOT.format(r'(\d+)'))
+
+
+def lido_tag(tag: str) -> str:
+    return tag.replace('lido:', f'{{{LIDO_NS}}}')
+
+
+def id_tags(id_map='lido-id-map.json') -> set:
+    '''Returns the ID element tags of a LIDO ID map, names of places are no IDs of their own'''
+    with open(id_map, encoding='utf-8') as f:
+        return {v['tag'] for v in json.load(f)['mapping'].values()} - {'lido:appellationValue'}
+
+
+def record_template(template='defaultLido.xml', id_map='lido-id-map.json', repeat=1, nesting=0) -> tuple[list, list]:
+    '''Returns the text parts of the template record and the (original value, unique per record) of the slots between them'''
+    root = etree.parse(template).getroot()
+    for tag in REPEATED_TAGS:
+        for elem in list(root.iter(lido_tag(tag))):
+            for _ in range(repeat - 1):
+                elem.addnext(copy.deepcopy(elem))
+    for place in list(root.iter(lido_tag('lido:place'))):
+        parent = place
+        for _ in range(nesting):
+            parent = etree.SubElement(parent, lido_tag('lido:partOfPlace'))
+            parent.extend(copy.deepcopy(e) for e in place if e.tag != lido_tag('lido:partOfPlace'))
+    slots = []
+    record_tags = {lido_tag(t) for t in RECORD_TAGS}
+    slot_tags = {lido_tag(t) for t in id_tags(id_map)}
+    for elem in root.iter():
+        if elem.tag in slot_tags and elem.text and elem.text.strip():
+            slots.append((elem.text.strip(), elem.tag in record_tags))
+            elem.text = SLOT.format(len(slots) - 1)
+        if about := elem.get(RDF_ABOUT):
+            slots.append((about, False))
+            elem.set(RDF_ABOUT, SLOT.format(len(slots) - 1))
+    parts = SLOT_PATTERN.split(etree.tostring(root, encoding='unicode'))
+    # The slots are in document order, every second part is a slot number
+    return parts[::2], [slots[int(n)] for n in parts[1::2]]
+
+
+def generate(records: int, repeat=1, nesting=0, vocabulary=1000, seed=0, **kw):
+    '''Yields the serialized records of a corpus, the same arguments give the same corpus'''
+    parts, slots = record_template(repeat=repeat, nesting=nesting, **kw)
+    rng = random.Random(seed)
+    for i in range(records):
+        values = [f'{value}-{i}' if unique else f'{value}-v{rng.randrange(vocabulary)}' for value, unique in slots]
+        yield ''.join(part + value for part, value in zip(parts, values)) + parts[-1]
+
+
+def write_corpus(path, records: int, **kw) -> int:
+    '''Writes a corpus of records wrapped in lido:lidoWrap and returns its size in bytes'''
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<lido:lidoWrap xmlns:lido="{LIDO_NS}">\n')
+        for record in generate(records, **kw):
+            f.write(record)
+            f.write('\n')
+        f.write('</lido:lidoWrap>\n')
+        return f.tell()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic LIDO corpus")
+    parser.add_argument('output', help="LIDO XML file to write")
+    parser.add_argument('-n', '--records', type=int, default=1000, help="Number of records")
+    parser.add_argument('-r', '--repeat', type=int, default=1, help="Copies of repeatable sets per record")
+    parser.add_argument('--nesting', type=int, default=0, help="Levels of lido:partOfPlace per place")
+    parser.add_argument('--vocabulary', type=int, default=1000, help="Number of values per shared ID")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the shared ID choices")
+    args = parser.parse_args()
+    size = write_corpus(args.output, args.records, repeat=args.repeat, nesting=args.nesting,
+                        vocabulary=args.vocabulary, seed=args.seed)
+    print(json.dumps({'records': args.records, 'bytes': size}))
@@ -1,15 +1,28 @@
 import re
-import time
+import io
+import sys
 import os
+import resource
+import itertools
+import collections
+import copy
+import threading
+import contextlib
 import shutil
 import rdflib as RF
 from rdflib.namespace import NamespaceManager
-import urllib.request as ulr
 import urllib.parse as ulp
-from pathlib import Path
 from lxml import etree
 import libs.x3ml as x3ml
+from libs.oai import RESUMPTION_TAG, DATE_TAG, HEADER_TAG, Checkpoint, Header, StateStore
+from libs.oai import create_oai_cmd, fetch_pages, harvest, make_spool_dir, state_key, with_from, write_tombstones
+from libs.oai import default_fetcher, delta_folder, partition_cmds, split_windows
 import hashlib
+from libs.metrics import NULL_METRICS
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 
 def p_log(f):
@@ -40,9 +53,6 @@ NAMESPACE_MAP = {
     "skos": RF.Namespace('http://www.w3.org/2004/02/skos/core#'),
 }
 LIDO_TAG = x3ml.expand_with_namespaces('lido:lido')
-OAI_SCHEMA_URL = 'http://www.openarchives.org/OAI/2.0/'
-RESUMPTION_TAG = f'{{{OAI_SCHEMA_URL}}}resumptionToken'
-DATE_TAG = f'{{{OAI_SCHEMA_URL}}}datestamp'
 
 
 def isURI(url: str) -> bool:
@@ -62,35 +72,6 @@ def proper_uri(uri: str | None) -> str | None:
         return uri_t
 
 
-def oai_request(server_url: str, oai_cmd: str) -> ulr.Request | None:
-    """Primary function for requesting OAI-PMH data from repository,
-       checking for errors, handling possible compression and returning
-       the XML string to the rest of the script for writing to a file."""
-
-    request_str = server_url + f'?verb={oai_cmd}'
-    headers = {'User-Agent': 'pyoaiharvester/3.0',
-               'Accept': 'text/html', 'Accept-Encoding': 'compress, deflate'}
-    try:
-        return ulr.Request(request_str, headers=headers)
-    except ulr.HTTPError as ex_value:
-        print('Http Error:', ex_value)
-        if ex_value.code == 503:
-            retry_wait = int(ex_value.hdrs.get("Retry-After", "-1"))
-            if retry_wait < 0:
-                return None
-            print(f'Waiting {retry_wait} seconds')
-            time.sleep(retry_wait)
-            return oai_request(server_url, oai_cmd)
-        return None
-
-
-def save_request_to_file(req: ulr.Request, buffer_file: str = 'oai.buffer.xml') -> str:
-    '''Write request response in a buffer file'''
-    with ulr.urlopen(req) as response:
-        Path(buffer_file).write_text(response.read().decode('utf-8'))
-        return buffer_file
-
-
 def make_result_graph() -> RF.Graph:
     '''Creates an RDF graph with bound namespaces'''
     graph = RF.Graph()
@@ -99,11 +80,155 @@ def make_result_graph() -> RF.Graph:
     return graph
 
 
+class GraphSink():
+    '''Collects the triples of all records in an RDF graph'''
+
+    def __init__(self):
+        self.graph = make_result_graph()
+        self.namespace_manager = self.graph.namespace_manager
+
+    text_format = 'nt'
+
+    def add(self, triples, graph=None) -> None:
+        self.graph += triples
+
+    def add_text(self, text: str) -> None:
+        '''Adds triples serialized in text_format'''
+        self.graph.parse(data=text, format=self.text_format)
+
+    def result(self) -> RF.Graph:
+        return self.graph
+
+
+class NTriplesSink():
+    '''Writes the triples of each record as N-Triples lines, or as N-Quads with the record (or a fixed graph) as graph
+
+    Triples are only unique per record, shared nodes of several records repeat their triples. With max_seen,
+    lines written before are dropped on a best-effort basis: 8-byte digests of the last max_seen lines (up to
+    twice as many) are remembered, so duplicates further apart are still written.
+    '''
+
+    def __init__(self, out, quads: bool = False, graph=None, max_seen: int = 0):
+        self.out = out
+        self.quads = quads
+        self.graph = graph
+        self.text_format = 'nquads' if quads else 'nt'
+        self.namespace_manager = make_result_graph().namespace_manager
+        self.seen, self.seen_before = set(), set()
+        self.max_seen = max_seen
+
+    def add(self, triples, graph=None) -> None:
+        graph = graph if self.graph is None else self.graph
+        end = f' {graph.n3()} .\n' if self.quads and graph is not None else ' .\n'
+        lines = (f'{nt_term(s)} {nt_term(p)} {nt_term(o)}{end}' for s, p, o in triples)
+        self.out.writelines(self.unseen(lines) if self.max_seen else lines)
+
+    def add_text(self, text: str) -> None:
+        '''Adds lines serialized in text_format'''
+        if self.max_seen:
+            self.out.writelines(self.unseen(text.splitlines(keepends=True)))
+        else:
+            self.out.write(text)
+
+    def unseen(self, lines) -> list:
+        '''Returns the lines whose digest is not remembered and remembers them'''
+        seen, seen_before = self.seen, self.seen_before
+        new = []
+        for line in lines:
+            digest = hashlib.blake2b(line.encode(), digest_size=8).digest()
+            if digest not in seen and digest not in seen_before:
+                seen.add(digest)
+                new.append(line)
+        if len(seen) >= self.max_seen:
+            self.seen_before, self.seen = seen, set()
+        return new
+
+    def result(self) -> None:
+        self.out.flush()
+        return None
+
+
+NT_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'})
+
+
+def nt_term(term) -> str:
+    '''Returns the N-Triples form of an RDF term'''
+    if isinstance(term, RF.Literal):
+        literal = f'"{str(term).translate(NT_ESCAPES)}"'
+        if term.language:
+            return f'{literal}@{term.language}'
+        if term.datatype:
+            return f'{literal}^^<{term.datatype}>'
+        return literal
+    return term.n3()
+
+
+STREAM_FORMATS = {'nt': False, 'nquads': True}
+'''Formats written by NTriplesSink, mapped to its quads flag'''
+
+
+def make_sink(format: str = '', out=None, max_seen: int = 0):
+    '''Creates a streaming sink for N-Triples/N-Quads output (dropping repeated lines with max_seen), else a graph sink'''
+    if out is not None and format in STREAM_FORMATS:
+        return NTriplesSink(out, STREAM_FORMATS[format], max_seen=max_seen)
+    return GraphSink()
+
+
+def release_element(elem) -> None:
+    '''Clears a processed element and drops the preceding siblings of it and its ancestors'''
+    elem.clear(keep_tail=True)
+    for e in (elem, *elem.iterancestors()):
+        if (parent := e.getparent()) is not None:
+            while e.getprevious() is not None:
+                del parent[0]
+
+
+def peak_rss() -> int:
+    '''Returns the peak resident set size of the process in bytes'''
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def chunked(iterable, size: int):
+    '''Yields lists of up to size items'''
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+WORKER = {}
+'''State of a worker process for parallel conversion'''
+
+
+def init_worker(converter) -> None:
+    '''Keeps the converter of a worker process, its mappings are compiled once'''
+    converter.mappings.compile()
+    WORKER['converter'] = converter
+
+
+def convert_records(records: list, text_format: str) -> str:
+    '''Converts serialized records in a worker process and returns the N-Triples/N-Quads text'''
+    converter = WORKER['converter']
+    out = io.StringIO()
+    sink = make_sink(text_format, out)
+    for ancestors, record in records:
+        elem = etree.fromstring(record)
+        # Rebuild the ancestor tags, the full path of elements is part of their IDs
+        parent = None
+        for tag in ancestors:
+            parent = etree.Element(tag) if parent is None else etree.SubElement(parent, tag)
+        if parent is not None:
+            parent.append(elem)
+        converter._update_ns(elem)
+        converter._process_lido_element(elem, sink)
+    return out.getvalue()
+
+
 def make_clean_subdir(dir_path: str) -> None:
     '''Creates a clean subdirectory for storing RDF files'''
     if os.path.exists(dir_path):
         shutil.rmtree(dir_path)
-    os.mkdir(dir_path)
+    os.makedirs(dir_path)
 
 
 def hash(s: str) -> str:
@@ -124,21 +249,89 @@ def make_curie_uri(uri: str, nsm: NamespaceManager) -> RF.term.URIRef:
         return RF.term.URIRef(uri)
 
 
-def make_id_node(info, nsm: NamespaceManager, prefix='', use_bn=False) -> RF.URIRef:
+def make_id_node(info, nsm: NamespaceManager, prefix='', use_bn=False, digest=hash) -> RF.URIRef:
     '''Creates an RDF node (URIRef or BNode) from info, using a hash of the ID'''
     if info.mode == x3ml.IDMode.ATTR_ID:
         return RF.URIRef(info.id)
     if info.mode == x3ml.IDMode.LOCAL_ID:
         label = prefix + '-' + info.id if prefix else info.id
         if use_bn:
-            return RF.BNode(hash(label))
+            return RF.BNode(digest(label))
         else:
-            return NAMESPACE_MAP['n4o'][f"{hash(label)}"]
-    uri = f'n4o:{hash(info.id)}'
-    try:
-        return nsm.expand_curie(uri)
-    except:
-        return RF.URIRef(uri)
+            return NAMESPACE_MAP['n4o'][f"{digest(label)}"]
+    return NAMESPACE_MAP['n4o'][digest(info.id)]
+
+
+ID_SCHEMES = ('v1', 'v2')
+'''Versioned ID schemes: v1 hashes IDs with md5, v2 with xxh3-128 (requires xxhash) and uses unique local IDs'''
+
+
+def id_digest(scheme: str = 'v1'):
+    '''Returns the hash function of a versioned ID scheme'''
+    if scheme == 'v1':
+        return hash
+    if scheme == 'v2':
+        if xxhash is None:
+            raise ValueError('ID scheme v2 requires the xxhash package')
+        # Versioned labels never collide with v1 IDs
+        return lambda s: 'v2-' + xxhash.xxh3_128_hexdigest(s.encode())
+    raise ValueError(f'Unknown ID scheme: {scheme}')
+
+
+class NodeFactory():
+    '''Mints the RDF nodes of a converter: CURIEs are expanded once, ID nodes are memoized per record'''
+
+    def __init__(self, use_bn: bool = False, id_scheme: str = 'v1'):
+        self.use_bn = use_bn
+        self.id_scheme = id_scheme
+        self.digest = id_digest(id_scheme)
+        self.nsm = make_result_graph().namespace_manager
+        self.curies = {}
+        self.nodes = {}
+        self.lookups = 0
+        self.prefix = ''
+        self.mappings = None
+
+    def __getstate__(self):
+        return {'use_bn': self.use_bn, 'id_scheme': self.id_scheme}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def resolve(self, mappings: x3ml.Mappings) -> None:
+        '''Expands the entity and relationship CURIEs of all mappings'''
+        self.mappings = mappings
+        for mapping in mappings:
+            self.curie(mapping.S.entity)
+            for po in mapping.POs:
+                self.curie(po.P.entity)
+                self.curie(po.O.entity)
+
+    def begin(self, prefix: str, mappings: x3ml.Mappings) -> None:
+        '''Starts a record, IDs of the previous record are dropped'''
+        if mappings is not self.mappings:
+            self.resolve(mappings)
+        self.prefix = prefix
+        self.nodes.clear()
+        self.lookups = 0
+
+    def curie(self, uri: str) -> RF.URIRef:
+        '''Returns the URIRef of a CURIE or URI string'''
+        if (node := self.curies.get(uri)) is None:
+            node = self.curies[uri] = make_curie_uri(uri, self.nsm)
+        return node
+
+    def id_node(self, info: x3ml.Info) -> RF.URIRef | RF.BNode:
+        '''Returns the node of an ID of the current record'''
+        key = (info.mode, info.id)
+        self.lookups += 1
+        if (node := self.nodes.get(key)) is None:
+            node = self.nodes[key] = make_id_node(info, self.nsm, self.prefix, self.use_bn, self.digest)
+        return node
+
+    def graph_node(self, record_id: str) -> RF.URIRef:
+        '''Returns the named graph of a record'''
+        return NAMESPACE_MAP['n4o'][self.digest(record_id)]
 
 
 def make_plain_node(info) -> RF.URIRef | RF.Literal:
@@ -151,47 +344,55 @@ def make_plain_node(info) -> RF.URIRef | RF.Literal:
 # def pd(*args): print([json.dumps(x, indent=2) for x in args])
 
 
-def get_spo_triples(mapping: x3ml.Mapping_Data, nsm: NamespaceManager, prefix: str, use_bn: bool) -> list:
+def get_spo_triples(mapping: x3ml.Mapping_Data, nodes: NodeFactory) -> list:
     '''Gets triples from mapping data, creating a node for the S entity and then compiling triples from the POs'''
     info = mapping.info
     triples = []
     if info.id:
-        S = make_id_node(info, nsm, prefix, use_bn)
-        triples += [(S, RF.RDF.type, make_curie_uri(mapping.S.entity, nsm))]
+        S = nodes.id_node(info)
+        triples += [(S, RF.RDF.type, nodes.curie(mapping.S.entity))]
 
         for po in mapping.po_data_list:
-            triples += get_po_triples(S, po, info, nsm, prefix, use_bn)
+            triples += get_po_triples(S, po, nodes)
+        if mapping.stats:
+            mapping.stats.triples += len(triples)
     return triples
 
 
-def get_po_triples(S,  po: x3ml.PO_Data, info: x3ml.Info, nsm: NamespaceManager, prefix: str, use_bn: bool) -> list:
+def get_po_triples(S, po: x3ml.PO_Data, nodes: NodeFactory) -> list:
     '''Gets triples from PO data'''
     triples = []
     if po.valid:
-        P = make_curie_uri(po.P.entity, nsm)
+        P = nodes.curie(po.P.entity)
         for info in po.infos:
             if info.hasID():
-                O = make_id_node(info, nsm, prefix, use_bn)
+                O = nodes.id_node(info)
                 if (O != S):
                     triples.append((S, P, O))
                     if info.map_class:  # Test for lido->crm mapping
-                        triples.append((O, RF.RDF.type, make_curie_uri(info.map_class, nsm)))
+                        triples.append((O, RF.RDF.type, nodes.curie(info.map_class)))
                     else:
-                        Ot = make_curie_uri(po.O.entity, nsm)
-                        triples.append((O, RF.RDF.type, Ot))
+                        triples.append((O, RF.RDF.type, nodes.curie(po.O.entity)))
             else:
                 if info.text:
                     O = make_plain_node(info)
                     triples.append((S, P, O))
+    if po.stats:
+        po.stats.triples += len(triples)
     return triples
 
 
-def updateNS(elem) -> None:
+NS_LOCK = threading.Lock()
+
+
+def updateNS(elem) -> bool:
     '''Updates the supported namespaces from the XML element (only one update)'''
     if x3ml.not_none(elem):
         if not hasattr(updateNS, "first"):
             x3ml.used_namespaces.update(get_ns(elem))
             updateNS.first = True
+            return True
+    return False
 
 
 def get_ns(elem):
@@ -199,107 +400,257 @@ def get_ns(elem):
     return dict(filter(lambda item: item[0], elem.nsmap.items()))
 
 
-def create_oai_cmd(args):
-    ''' Creates an oai-pmh cmd, e.g. ListRecords&from=2002-06-01T02:00:00Z&until=2002-06-01T03:00:00Z&metadataPrefix=lido'''
-    cmd = 'ListRecords'
-    if args:
-        if args.oai_from:
-            cmd += f'&from={args.oai_from}'
-        if args.oai_to:
-            cmd += f'&until={args.oai_to}'
-    cmd += '&metadataPrefix=lido'
-    return cmd
-
-
 class LidoRDFConverter():
     '''Converts LIDO XML files to RDF graphs using X3ML mappings'''
 
-    def __init__(self, file_path, use_bn=False):
-        self.mappings = x3ml.Mappings.from_file(file_path)
+    def __init__(self, file_path, use_bn=False, read_only=False, id_scheme='v1', metrics=NULL_METRICS):
+        self.metrics = metrics
+        self.mappings = self._load_mappings(x3ml.Mappings.from_file, file_path) if file_path else x3ml.Mappings()
         self.use_bn = use_bn
+        self.read_only = read_only
+        self.nodes = NodeFactory(use_bn, id_scheme)
 
     Graph = RF.Graph
 
     @classmethod
     def from_str(cls, mapping_str, **kw):
-        obj = cls('', kw.get('useBlankNode', False))
-        obj.mappings = x3ml.Mappings.from_str(mapping_str)
+        obj = cls('', kw.get('useBlankNode', False), kw.get('readOnly', False),
+                  kw.get('idScheme', 'v1'), kw.get('metrics', NULL_METRICS))
+        obj.mappings = obj._load_mappings(x3ml.Mappings.from_str, mapping_str)
         return obj
 
+    @classmethod
+    def from_mappings(cls, mappings: x3ml.Mappings, **kw):
+        '''Creates a converter for already compiled mappings'''
+        obj = cls('', kw.get('useBlankNode', False), kw.get('readOnly', False),
+                  kw.get('idScheme', 'v1'), kw.get('metrics', NULL_METRICS))
+        obj.mappings = mappings
+        return obj
+
+    def _load_mappings(self, load, source) -> x3ml.Mappings:
+        with self.metrics.time('mapping_load'):
+            return load(source)
+
+    def serialize(self, graph: RF.Graph, format: str, destination=None) -> str | None:
+        '''Serializes a result graph to a string or to the destination file'''
+        with self.metrics.time('rdf_serialize'):
+            if destination is None:
+                return graph.serialize(format=format)
+            graph.serialize(destination=destination, format=format, encoding='utf-8')
+
     def process_url(self, server_url: str, **kw) -> Graph | None:
         if server_url.endswith('.xml'):
             '''Fetches and parses a single LIDO XML file from a URL'''
-            headers = {'Accept': 'text/html', 'Accept-Encoding': 'compress, deflate'}
-            request = ulr.Request(server_url, headers=headers)
-            with ulr.urlopen(request) as response:
-                graph, _ = self.parse_file(response)
+            with default_fetcher(kw.get('fetcher')).open(server_url) as response:
+                graph, _ = self.parse_file(response, kw.get('sink'))
                 return graph
         else:
             '''Fetches and processes LIDO records from an OAI-PMH endpoint'''
-            rdf_folder = kw.get('rdf_folder', 'data')
-            format = kw.get('suffix', 'ttl')
             oai_cmd = create_oai_cmd(kw.get('args'))
+            rdf_folder = kw.pop('rdf_folder', 'data')
+            if kw.get('sets') or kw.get('split', 1) > 1:
+                windows = split_windows(server_url, oai_cmd, kw['split'], kw.get('fetcher')) if kw.get('split', 1) > 1 else []
+                if windows and kw.get('state'):
+                    raise ValueError('Incremental harvests cannot be split into date windows')
+                self.harvest_partitions(server_url, partition_cmds(oai_cmd, kw.get('sets'), windows), rdf_folder, **kw)
+            else:
+                self.harvest_oai(server_url, oai_cmd, rdf_folder, **kw)
+        return None
+
+    def harvest_partitions(self, server_url: str, oai_cmds: dict, rdf_folder: str, **kw) -> dict:
+        '''Harvests requests into partitions of rdf_folder named by their keys, streams of them run in parallel
 
+        Each partition keeps its own checkpoint and, for incremental harvests of sets, its own state.
+        '''
+        if kw.get('resume') or kw.get('state'):
+            os.makedirs(rdf_folder, exist_ok=True)
+        else:
             make_clean_subdir(rdf_folder)
-            request = oai_request(server_url, oai_cmd)
-            index = 0
-            while request:
-                buffer_file = save_request_to_file(request)
-                graph, token = self.parse_file(buffer_file)
-                destination = f'./{rdf_folder}/lido_records_{index:05d}.{format}'
-                graph.serialize(destination=destination, format=format, encoding='utf-8')
-                if token:
-                    request = oai_request(server_url, f"ListRecords&resumptionToken={token}")
-                    index += 1
-                else:
-                    request = None
-        return None
 
-    def parse_file(self, lido_file) -> tuple[RF.Graph, str]:
-        '''Parses a LIDO file and returns the RDF graph and a resumption token'''
-        graph = make_result_graph()
-        valid_tag = (LIDO_TAG, RESUMPTION_TAG, 'error')  # , DATE_TAG)
+        def run(item):
+            name, oai_cmd = item
+            # Minted nodes are memoized per record, each stream needs its own factory
+            converter = copy.copy(self)
+            converter.nodes = NodeFactory(self.use_bn, self.nodes.id_scheme)
+            return name, converter.harvest_oai(server_url, oai_cmd, f'{rdf_folder}/{name}', **kw)
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(kw.get('streams', 4)) as pool:
+            return dict(pool.map(run, oai_cmds.items()))
+
+    def harvest_oai(self, server_url: str, oai_cmd: str, rdf_folder: str, **kw) -> Checkpoint:
+        '''Harvests an OAI-PMH list request into one RDF file per page, a checkpoint is saved after each page
+
+        With a state store file, the harvest starts at the latest datestamp of the last complete harvest of
+        the endpoint and is written into a subfolder named by that datestamp, earlier harvests are kept.
+        Deleted records are written as tombstones next to the RDF file of their page.
+        '''
+        suffix = kw.get('suffix', 'ttl')
+        format = kw.get('format') or suffix
+        store = StateStore.load(kw['state']) if kw.get('state') else None
+        key = state_key(server_url, oai_cmd)
+        if store:
+            oai_cmd = with_from(oai_cmd, store.get(key))
+            rdf_folder = delta_folder(rdf_folder, oai_cmd)
+        checkpoint_file = f'{str(rdf_folder).rstrip("/")}.checkpoint.json'
+        checkpoint = Checkpoint(server_url, oai_cmd)
+        if kw.get('resume') and (saved := Checkpoint.load(checkpoint_file)):
+            if (saved.server_url, saved.oai_cmd) != (server_url, oai_cmd):
+                raise ValueError(f'{checkpoint_file} belongs to a harvest of {saved.server_url} ({saved.oai_cmd})')
+            checkpoint = saved
+            os.makedirs(rdf_folder, exist_ok=True)
+        else:
+            make_clean_subdir(rdf_folder)
+        depth = kw.get('prefetch', 2)
+        spool = make_spool_dir(kw.get('spool'))
+
+        def convert(page):
+            destination = f'{rdf_folder}/lido_records_{page.index:05d}.{suffix}'
+            headers = []
+            # Pages are parsed while they are received, files are only complete after the rename
+            with contextlib.closing(page.stream):
+                if format in STREAM_FORMATS:
+                    with open(destination + '.part', 'w', encoding='utf-8') as out:
+                        self.parse_file(page.stream, make_sink(format, out), headers)
+                    return page, destination, None, headers
+                return page, destination, self.parse_file(page.stream, None, headers)[0], headers
+
+        def write(result):
+            page, destination, graph, headers = result
+            if graph is not None:
+                self.serialize(graph, format, destination + '.part')
+            os.replace(destination + '.part', destination)
+            write_tombstones(f'{rdf_folder}/lido_records_{page.index:05d}.deleted.jsonl', headers)
+            checkpoint.update(page, headers).save(checkpoint_file)
+
+        if not checkpoint.done:
+            # Fetch the next page and write the last one while converting a page
+            pages = fetch_pages(server_url, oai_cmd, spool, pumped=depth > 0, index=checkpoint.index + 1, token=checkpoint.token,
+                                fetcher=kw.get('fetcher'))
+            harvest(pages, convert, write, depth)
+        if store:
+            store.put(key, checkpoint.datestamp)
+            store.save()
+        return checkpoint
+
+    def parse_file(self, lido_file, sink=None, headers=None) -> tuple[RF.Graph | None, str]:
+        '''Parses a LIDO file and returns the RDF graph (None for streaming sinks) and a resumption token
+
+        OAI-PMH record headers are appended to the list headers if given.
+        '''
+        sink = sink or GraphSink()
+        valid_tag = (LIDO_TAG, RESUMPTION_TAG, 'error') + ((HEADER_TAG,) if headers is not None else ())
         next_token = ''
-        for _, elem in etree.iterparse(lido_file, events=("end",),  tag=valid_tag, encoding='UTF-8', remove_blank_text=True):
-            updateNS(elem)
-            next_token = self._process_valid_element(graph, elem)
-        return graph, next_token
+        events = etree.iterparse(lido_file, events=("end",),  tag=valid_tag, encoding='UTF-8', remove_blank_text=True)
+        while True:
+            with self.metrics.time('xml_parse'):
+                _, elem = next(events, (None, None))
+            if elem is None:
+                break
+            self._update_ns(elem)
+            if elem.tag == HEADER_TAG:
+                headers.append(Header.from_elem(elem))
+            next_token = self._process_valid_element(sink, elem)
+        return sink.result(), next_token
+
+    def _update_ns(self, elem) -> None:
+        '''Updates the namespaces once, parallel harvests wait until the xpaths are rebound'''
+        with NS_LOCK:
+            if updateNS(elem):
+                # Rebind compiled xpaths to the updated namespaces
+                self.mappings.compile()
+
+    def parse_file_parallel(self, lido_file, workers: int, sink=None, chunk_size: int = 32) -> RF.Graph | None:
+        '''Parses a LIDO file with a pool of worker processes and returns the RDF graph (None for streaming sinks)'''
+        sink = sink or GraphSink()
+        import multiprocessing
+        with multiprocessing.Pool(workers, init_worker, (self,)) as pool:
+            pending = collections.deque()
+            for chunk in chunked(self._serialized_records(lido_file), chunk_size):
+                pending.append(pool.apply_async(convert_records, (chunk, sink.text_format)))
+                # Bounded number of chunks in flight, results are added in input order
+                if len(pending) >= 4 * workers:
+                    sink.add_text(pending.popleft().get())
+            while pending:
+                sink.add_text(pending.popleft().get())
+        return sink.result()
+
+    def _serialized_records(self, lido_file):
+        '''Yields the ancestor tags and the serialization of each LIDO record'''
+        for _, elem in etree.iterparse(lido_file, events=("end",), tag=LIDO_TAG, encoding='UTF-8', remove_blank_text=True):
+            ancestors = [e.tag for e in elem.iterancestors()][::-1]
+            yield ancestors, etree.tostring(elem, with_tail=False)
+            release_element(elem)
+
+    def parse_to_file(self, lido_file, destination, format) -> str:
+        '''Parses a LIDO file into an RDF file, streamed for N-Triples/N-Quads, returns a resumption token'''
+        if format in STREAM_FORMATS:
+            with open(destination, 'w', encoding='utf-8') as out:
+                return self.parse_file(lido_file, make_sink(format, out))[1]
+        graph, token = self.parse_file(lido_file)
+        self.serialize(graph, format, destination)
+        return token
 
-    def parse_string(self, lido_str) -> RF.Graph:
-        '''Parses a LIDO string and returns the RDF graph'''
-        parser = etree.XMLPullParser(events=("end",), tag=(LIDO_TAG), encoding='UTF-8', remove_blank_text=True)
-        parser.feed(lido_str)
-        graph = make_result_graph()
-        for _, elem in parser.read_events():
-            self._process_lido_element(elem, graph)
-        return graph
+    def parse_string(self, lido_str, sink=None) -> RF.Graph | None:
+        '''Parses a LIDO string and returns the RDF graph (None for streaming sinks)'''
+        sink = sink or GraphSink()
+        for _ in self.parse_chunks([lido_str], sink):
+            pass
+        return sink.result()
 
-    def _process_valid_element(self, graph, elem) -> str:
+    def parse_chunks(self, chunks, sink):
+        '''Parses LIDO from string or byte chunks, yields once the records completed by a chunk are in the sink'''
+        parser = etree.XMLPullParser(events=("end",), tag=(LIDO_TAG), encoding='UTF-8', remove_blank_text=True)
+        for chunk in itertools.chain(chunks, [None]):
+            with self.metrics.time('xml_parse'):
+                if chunk is None:
+                    parser.close()
+                else:
+                    parser.feed(chunk)
+            self.metrics.count('input_bytes', len(chunk or ''))
+            for _, elem in parser.read_events():
+                self._process_lido_element(elem, sink)
+                release_element(elem)
+            yield
+
+    def _process_valid_element(self, sink, elem) -> str:
         '''Process valid LIDO or resumptionToken elements'''
         token = ''
         if RESUMPTION_TAG == elem.tag:
             token = elem.text
-            print('completeListSize', elem.attrib['completeListSize'])
-            print('cursor', elem.attrib['cursor'])
-            print('expirationDate', elem.attrib['expirationDate'])
-            print('token', token)
+            print('completeListSize', elem.get('completeListSize'), file=sys.stderr)
+            print('cursor', elem.get('cursor'), file=sys.stderr)
+            print('expirationDate', elem.get('expirationDate'), file=sys.stderr)
+            print('token', token, file=sys.stderr)
         elif elem.tag == LIDO_TAG:
-            self._process_lido_element(elem, graph)
+            self._process_lido_element(elem, sink)
         elif elem.tag == DATE_TAG:
-            print(f'Date: {elem.text}')
+            print(f'Date: {elem.text}', file=sys.stderr)
+        elif elem.tag == HEADER_TAG:
+            pass
         elif 'error' in elem.tag:
-            print('error', elem.tag, elem.text)
+            print('error', elem.tag, elem.text, file=sys.stderr)
         else:
-            print('unexpeced :-(')
-        elem.clear()
+            print('unexpeced :-(', file=sys.stderr)
+        # Hold only the current record, iterparse keeps the processed ones attached to the root
+        release_element(elem)
         return token
 
-    def _process_lido_element(self, elem, graph) -> None:
-        '''Create graph LIDO root element w.r.t given mappings'''
+    def _process_lido_element(self, elem, sink) -> None:
+        '''Create triples of a LIDO root element w.r.t given mappings and pass them to the sink'''
         recIDs = x3ml.xpath_lido(elem, "./lido:lidoRecID/text()")
         recID = ' '.join([x.strip() for x in recIDs])
-        for data in [m.evaluate(elem) for m in self.mappings]:
-            for i, mapping_data in enumerate(data):
-                if mapping_data.valid:
-                    triples = get_spo_triples(mapping_data, graph.namespace_manager, recID, self.use_bn)
-                    graph += triples
+        # Read-only: derived texts and IDs are kept in side tables instead of the tree
+        record = x3ml.Record(root=elem, read_only=self.read_only, id_scheme=self.nodes.id_scheme)
+        self.nodes.begin(recID, self.mappings)
+        triples = {}
+        with self.metrics.time('mapping_evaluation'):
+            for data in [m.evaluate(elem, record) for m in self.mappings]:
+                for i, mapping_data in enumerate(data):
+                    if mapping_data.valid:
+                        triples.update(dict.fromkeys(get_spo_triples(mapping_data, self.nodes)))
+        with self.metrics.time('rdf_emit'):
+            sink.add(triples, self.nodes.graph_node(recID))
+        self.metrics.count('records')
+        self.metrics.count('triples', len(triples))
+        self.metrics.cache('id_node', self.nodes.lookups - len(self.nodes.nodes), len(self.nodes.nodes))
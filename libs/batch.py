@@ -0,0 +1,138 @@
+import io
+import os
+import re
+import sys
+import glob
+import multiprocessing
+from pathlib import Path
+from libs.LidoRDFConverter import WORKER, init_worker, make_sink
+
+GLOB_CHARS = re.compile(r'[*?[]')
+
+
+def is_batch(sources: list) -> bool:
+    '''Tests if the sources name more than one file, or a directory, a glob pattern or an @list'''
+    return len(sources) > 1 or any(s.startswith('@') or os.path.isdir(s) or GLOB_CHARS.search(s) for s in sources)
+
+
+def expand_sources(sources: list) -> list:
+    '''Returns the (file, output name) of LIDO sources given as files, directories, glob patterns or @lists of them
+
+    Files in a directory keep their path relative to it as output name, other files their file name. Raises
+    ValueError if a directory, glob pattern or @list has no files.
+    '''
+    files = []
+    for source in sources:
+        if source.startswith('@'):
+            with open(source[1:], encoding='utf-8') as f:
+                found = expand_sources([line.strip() for line in f if line.strip() and not line.startswith('#')])
+        elif os.path.isdir(source):
+            root = Path(source)
+            found = [(p, p.relative_to(root)) for p in sorted(root.rglob('*.xml')) if p.is_file()]
+        elif GLOB_CHARS.search(source):
+            found = [(Path(p), Path(Path(p).name)) for p in sorted(glob.glob(source, recursive=True)) if os.path.isfile(p)]
+        else:
+            found = [(Path(source), Path(Path(source).name))]
+        if not found:
+            raise ValueError(f'No LIDO files found in {source}')
+        files += found
+    return files
+
+
+def output_files(files: list, out_dir, suffix: str) -> list:
+    '''Returns the (file, output file) of the inputs, output names must be distinct'''
+    outputs = {}
+    for file, name in files:
+        output = Path(out_dir) / name.with_suffix(f'.{suffix}')
+        if output in outputs:
+            raise ValueError(f'{outputs[output]} and {file} would both be converted to {output}')
+        outputs[output] = file
+    return [(file, output) for output, file in outputs.items()]
+
+
+def up_to_date(file: Path, output: Path, since: float = 0.0) -> bool:
+    '''Tests if the output is newer than its input file and since (the mapping modification time)'''
+    try:
+        return output.stat().st_mtime >= max(file.stat().st_mtime, since)
+    except FileNotFoundError:
+        return False
+
+
+def convert_file(converter, file: str, output: str, format: str) -> str:
+    '''Converts a LIDO file into an output file, which only exists once complete, returns an error message'''
+    part = f'{output}.part'
+    try:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        converter.parse_to_file(file, part, format)
+        os.replace(part, output)
+        return ''
+    except Exception as ex:
+        if os.path.exists(part):
+            os.remove(part)
+        return f'{file}: {ex}'
+
+
+def convert_file_in_worker(job: tuple) -> str:
+    return convert_file(WORKER['converter'], *job)
+
+
+def convert_text_in_worker(job: tuple) -> tuple[str, str]:
+    '''Converts a LIDO file in a worker process, returns its triples serialized in text_format and an error message'''
+    file, text_format = job
+    out = io.StringIO()
+    try:
+        WORKER['converter'].parse_file(file, make_sink(text_format, out))
+    except Exception as ex:
+        return '', f'{file}: {ex}'
+    return out.getvalue(), ''
+
+
+def run_jobs(converter, worker_func, jobs: list, workers: int):
+    '''Yields the results of jobs, ordered by a pool of workers processes or in this process'''
+    if workers > 1:
+        with multiprocessing.Pool(workers, init_worker, (converter,)) as pool:
+            yield from pool.imap(worker_func, jobs)
+    else:
+        WORKER['converter'] = converter
+        yield from map(worker_func, jobs)
+
+
+def convert_files(converter, files: list, out_dir, format: str, suffix: str, since: float = 0.0, force: bool = False,
+                  workers: int = 1) -> dict:
+    '''Converts LIDO files into one output file each, skips outputs which are up to date unless forced
+
+    Returns the numbers of converted, skipped and failed files, the errors are printed to stderr.
+    '''
+    jobs = [(str(file), str(output), format) for file, output in output_files(files, out_dir, suffix)
+            if force or not up_to_date(file, output, since)]
+    counts = {'converted': 0, 'skipped': len(files) - len(jobs), 'failed': 0}
+    for message in run_jobs(converter, convert_file_in_worker, jobs, workers):
+        if message:
+            print(message, file=sys.stderr)
+        counts['failed' if message else 'converted'] += 1
+    return counts
+
+
+def convert_merged(converter, files: list, sink, workers: int = 1) -> dict:
+    '''Converts LIDO files into one sink in input order, returns the numbers of converted and failed files'''
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    if workers > 1:
+        results = run_jobs(converter, convert_text_in_worker, [(str(f), sink.text_format) for f, _ in files], workers)
+    else:
+        results = (merge_file(converter, file, sink) for file, _ in files)
+    for text, message in results:
+        if message:
+            print(message, file=sys.stderr)
+        elif text:
+            sink.add_text(text)
+        counts['failed' if message else 'converted'] += 1
+    return counts
+
+
+def merge_file(converter, file, sink) -> tuple[str, str]:
+    '''Converts a LIDO file into a sink, returns no text and an error message'''
+    try:
+        converter.parse_file(file, sink)
+    except Exception as ex:
+        return '', f'{file}: {ex}'
+    return '', ''
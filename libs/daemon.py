@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import struct
+import socket
+import shutil
+import signal
+import threading
+import socketserver
+
+DATA, ERROR, DONE = b'D', b'E', b'O'
+'''Kinds of the response frames: RDF output, error message, end of a successful conversion'''
+FRAME_HEADER = struct.Struct('>cI')
+CHUNK_SIZE = 2**16
+
+
+def default_socket() -> str:
+    '''Returns the socket path in $XDG_RUNTIME_DIR, else a per-user path in the temp directory'''
+    if runtime_dir := os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(runtime_dir, 'lido2rdf.sock')
+    return f'/tmp/lido2rdf-{os.getuid()}.sock'
+
+
+def send_frame(out, kind: bytes, payload: bytes = b'') -> None:
+    out.write(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+
+def read_frames(stream):
+    '''Yields the (kind, payload) frames of a response'''
+    while header := stream.read(FRAME_HEADER.size):
+        if len(header) < FRAME_HEADER.size:
+            raise ConnectionError('Incomplete response of the conversion daemon')
+        kind, size = FRAME_HEADER.unpack(header)
+        yield kind, stream.read(size)
+
+
+class FrameWriter():
+    '''Text stream that sends the RDF output of a sink in data frames'''
+
+    def __init__(self, out):
+        self.out = out
+        self.buffer = []
+        self.size = 0
+
+    def write(self, text: str) -> None:
+        data = text.encode('utf-8')
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= CHUNK_SIZE:
+            self.flush()
+
+    def writelines(self, lines) -> None:
+        for line in lines:
+            self.write(line)
+
+    def flush(self) -> None:
+        if self.buffer:
+            send_frame(self.out, DATA, b''.join(self.buffer))
+            self.buffer, self.size = [], 0
+
+
+class ConversionHandler(socketserver.StreamRequestHandler):
+    '''Reads a JSON request line and the LIDO input until the client shuts down writing, answers with frames'''
+
+    def handle(self):
+        if not (line := self.rfile.readline()):
+            return  # a probe of a starting daemon
+        out = FrameWriter(self.wfile)
+        try:
+            self.server.convert(json.loads(line), self.rfile, out)
+            out.flush()
+            send_frame(self.wfile, DONE)
+        except Exception as ex:
+            try:
+                out.flush()
+                send_frame(self.wfile, ERROR, f'{type(ex).__name__}: {ex}'.encode('utf-8'))
+            except OSError:
+                pass  # the client is gone
+
+
+class ConversionServer(socketserver.UnixStreamServer):
+    '''Converts LIDO sent over a Unix domain socket with mappings kept in memory
+
+    Requests are handled one after the other, further clients wait in the listen queue. Mapping files are
+    only parsed again after a change.
+    '''
+
+    def __init__(self, socket_path: str):
+        from libs.mapping_cache import MappingCache
+        self.socket_path = socket_path
+        self.cache = MappingCache()
+        if os.path.exists(socket_path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                if probe.connect_ex(socket_path) == 0:
+                    raise OSError(f'A daemon is already listening on {socket_path}')
+            os.unlink(socket_path)
+        # Only the user may connect
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, ConversionHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def convert(self, request: dict, lido_file, out) -> None:
+        '''Converts a LIDO stream as the CLI would, the output is written as text to out'''
+        # Imported by the daemon only, clients start without rdflib and lxml
+        from libs.LidoRDFConverter import LidoRDFConverter, STREAM_FORMATS, make_sink
+        mappings = self.cache.get_file(request['mapping'])
+        converter = LidoRDFConverter.from_mappings(mappings, readOnly=request.get('read_only', False),
+                                                   idScheme=request.get('id_scheme', 'v1'))
+        format = request.get('format', 'turtle')
+        if format in STREAM_FORMATS:
+            converter.parse_file(lido_file, make_sink(format, out))
+        else:
+            graph, _ = converter.parse_file(lido_file)
+            out.write(converter.serialize(graph, format))
+
+
+def serve(socket_path: str) -> None:
+    '''Runs the conversion daemon until it is interrupted'''
+    # Stopped like by Ctrl-C, the socket file is removed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with ConversionServer(socket_path) as server:
+        print(f'Converting LIDO sent to {socket_path}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+class RemoteError(Exception):
+    '''Raised when the daemon reports a failed conversion'''
+
+
+def convert_remote(socket_path: str, request: dict, source, target) -> None:
+    '''Sends the binary stream source to the daemon and writes the RDF output to the binary stream target'''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+
+        def send():
+            # Sent by a thread, the daemon answers while it still reads
+            try:
+                with sock.makefile('wb') as f:
+                    f.write(json.dumps(request).encode('utf-8') + b'\n')
+                    shutil.copyfileobj(source, f, CHUNK_SIZE)
+                sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass  # the daemon failed and closed the connection, its error frame tells why
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+        with sock.makefile('rb') as response:
+            for kind, payload in read_frames(response):
+                if kind == DATA:
+                    target.write(payload)
+                elif kind == ERROR:
+                    raise RemoteError(payload.decode('utf-8'))
+                elif kind == DONE:
+                    break
+            else:
+                raise ConnectionError('The conversion daemon closed the connection')
+        sender.join()
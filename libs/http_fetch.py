@@ -0,0 +1,203 @@
+import sys
+import time
+import zlib
+import threading
+import http.client
+import email.utils
+import urllib.parse as ulp
+import urllib.request as ulr
+from urllib.error import HTTPError, URLError
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+REDIRECT_STATUS = {301, 302, 303, 307, 308}
+CHUNK_SIZE = 2**16
+HEADERS = {'User-Agent': 'pyoaiharvester/3.0', 'Accept': 'text/xml, application/xml, */*',
+           'Accept-Encoding': 'gzip, deflate'}
+
+
+def retry_after(value: str | None) -> float | None:
+    '''Returns the seconds to wait of a Retry-After header, given as seconds or as HTTP date'''
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Response():
+    '''Reads the decoded body of a response, gzip and deflate transfers are decompressed while reading'''
+
+    def __init__(self, raw, release=None, slot=None):
+        self.raw = raw
+        self.slot = slot
+        self.status = raw.status or 200
+        self.headers = raw.headers
+        self.url = getattr(raw, 'url', '')
+        self.release = release
+        encoding = (raw.headers.get('Content-Encoding') or '').strip().lower()
+        # wbits 47 detects gzip and zlib headers, raw deflate streams are detected on the first chunk
+        self.decoder = zlib.decompressobj(47) if encoding in ('gzip', 'x-gzip', 'deflate') else None
+        self.raw_deflate = encoding == 'deflate'
+        self.buffer = b''
+        self.eof = False
+
+    def _decode(self, chunk: bytes) -> bytes:
+        try:
+            return self.decoder.decompress(chunk)
+        except zlib.error:
+            if not self.raw_deflate:
+                raise
+            self.raw_deflate = False
+            self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decoder.decompress(chunk)
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.eof and (size < 0 or not self.buffer):
+            chunk = self.raw.read(CHUNK_SIZE)
+            if chunk:
+                self.buffer += self._decode(chunk) if self.decoder else chunk
+            else:
+                self.eof = True
+                if self.decoder:
+                    self.buffer += self.decoder.flush()
+        data = self.buffer if size < 0 else self.buffer[:size]
+        self.buffer = self.buffer[len(data):]
+        return data
+
+    def close(self) -> None:
+        if self.release:
+            self.release(self.raw, self.eof)
+            self.release = None
+        else:
+            self.raw.close()
+        if self.slot:
+            self.slot.release()
+            self.slot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Fetcher():
+    '''Fetches URLs over kept-alive connections with compressed transfer, timeouts and retries
+
+    Failed requests (connection errors, status 429 and 5xx) are repeated up to retries times. They wait as
+    long as the Retry-After header says, or with exponential backoff, at most max_wait seconds.
+    With a host limit, at most host_limit responses per host are open at once over all threads.
+    '''
+
+    def __init__(self, timeout: float = 60, retries: int = 5, backoff: float = 1.0, max_wait: float = 300,
+                 host_limit: int = 0):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.host_limit = host_limit
+        self.local = threading.local()
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def _slot(self, url: str) -> threading.BoundedSemaphore | None:
+        if self.host_limit <= 0:
+            return None
+        host = ulp.urlsplit(url).hostname
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.host_limit)
+            return self.slots[host]
+
+    def _connections(self) -> dict:
+        # Connections are not shared between threads
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+        return self.local.connections
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        connections = self._connections()
+        if (scheme, netloc) not in connections:
+            cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            connections[scheme, netloc] = cls(netloc, timeout=self.timeout)
+        return connections[scheme, netloc]
+
+    def _drop(self, scheme: str, netloc: str) -> None:
+        if connection := self._connections().pop((scheme, netloc), None):
+            connection.close()
+
+    def _request(self, url: str, headers: dict):
+        '''Sends a request, over a kept-alive connection for http(s) URLs without proxy'''
+        parts = ulp.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or ulr.getproxies().get(parts.scheme) and not ulr.proxy_bypass(parts.hostname):
+            try:
+                return ulr.urlopen(ulr.Request(url, headers=headers), timeout=self.timeout), None
+            except HTTPError as error:
+                return error, None
+        connection = self._connection(parts.scheme, parts.netloc)
+        reused = connection.sock is not None
+        path = ulp.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        try:
+            connection.request('GET', path, headers=headers)
+            raw = connection.getresponse()
+        except (OSError, http.client.HTTPException):
+            self._drop(parts.scheme, parts.netloc)
+            if reused:
+                # The server closed the idle connection
+                return self._request(url, headers)
+            raise
+
+        def release(raw, complete):
+            # An unread body would be taken for the next response
+            raw.close()
+            if not complete or raw.will_close:
+                self._drop(parts.scheme, parts.netloc)
+        return raw, release
+
+    def wait(self, attempt: int, headers=None) -> float:
+        '''Returns the seconds to wait before repeating a request'''
+        wait = retry_after(headers.get('Retry-After')) if headers is not None else None
+        return min(self.max_wait, self.backoff * 2**attempt if wait is None else wait)
+
+    def open(self, url: str, headers: dict = None) -> Response:
+        '''Returns the response of a GET request, HTTPError or URLError after failed retries'''
+        headers = {**HEADERS, **(headers or {})}
+        redirects = 0
+        attempt = 0
+        while True:
+            if slot := self._slot(url):
+                slot.acquire()
+            try:
+                try:
+                    raw, release = self._request(url, headers)
+                except (OSError, http.client.HTTPException) as ex:
+                    error, wait = URLError(ex), self.wait(attempt)
+                else:
+                    # Responses of file: URLs have no status
+                    status = raw.status or 200
+                    location = raw.headers.get('Location') if status in REDIRECT_STATUS else None
+                    if status < 400 and not location:
+                        # The response holds the host slot until it is closed
+                        response, slot = Response(raw, release, slot), None
+                        return response
+                    with Response(raw, release) as response:
+                        response.read()
+                    if location and redirects < 10:
+                        url = ulp.urljoin(url, location)
+                        redirects += 1
+                        continue
+                    error = HTTPError(url, status, raw.reason, raw.headers, None)
+                    if status not in RETRY_STATUS:
+                        raise error
+                    wait = self.wait(attempt, raw.headers)
+            finally:
+                if slot:
+                    slot.release()
+            if attempt >= self.retries:
+                raise error
+            print(f'{error}, retrying in {wait:.1f} seconds', file=sys.stderr)
+            time.sleep(wait)
+            attempt += 1
@@ -0,0 +1,137 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+import multiprocessing
+from pathlib import Path
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor
+from libs.mapping_cache import MappingCache
+from libs.x3ml import load_lido_map
+
+WORKER_CACHE = MappingCache()
+'''Compiled mappings of a worker process'''
+
+
+def convert_job(job_dir: str, mapping_path: str, format: str, use_bn: bool) -> None:
+    '''Converts the spooled LIDO file of a job in a worker process, the result is written next to it'''
+    from libs.LidoRDFConverter import LidoRDFConverter
+    job_dir = Path(job_dir)
+    (job_dir / 'started').touch()
+    converter = LidoRDFConverter.from_mappings(WORKER_CACHE.get_file(mapping_path), useBlankNode=use_bn)
+    part = job_dir / f'result.{format}.part'
+    converter.parse_to_file(job_dir / 'input.xml', part, format)
+    os.replace(part, job_dir / f'result.{format}')
+
+
+@dataclass
+class Job:
+    '''A conversion job with its input and result spooled in dir'''
+    id: str = ''
+    dir: str = ''
+    status: str = 'queued'
+    format: str = 'turtle'
+    created: float = 0.0
+    finished: float = 0.0
+    error: str = ''
+
+    def result_path(self) -> Path:
+        return Path(self.dir) / f'result.{self.format}'
+
+    def to_dict(self) -> dict:
+        return {k: v for k, v in asdict(self).items() if k != 'dir' and v != ''}
+
+
+class QueueFull(Exception):
+    '''Raised when a job is submitted to a full queue'''
+
+    def __init__(self, retry_after: int):
+        super().__init__(f'Job queue is full, retry after {retry_after} seconds')
+        self.retry_after = retry_after
+
+
+class JobQueue():
+    '''Runs conversion jobs in a bounded pool of worker processes, inputs and results are spooled to disk
+
+    At most workers jobs run at once and max_queued wait, further submissions raise QueueFull.
+    Finished jobs are removed after ttl seconds.
+    '''
+
+    def __init__(self, spool_dir, workers: int = 2, max_queued: int = 8, ttl: float = 3600, retry_after: int = 10):
+        self.spool_dir = Path(spool_dir)
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Started with the first job, spawned workers are safe in a threaded server
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'), initializer=load_lido_map)
+        return self.pool
+
+    def pending(self) -> int:
+        '''Returns the number of queued and running jobs'''
+        return sum(job.status in ('queued', 'running') for job in self.jobs.values())
+
+    def submit(self, write_input, mapping_path=None, mapping_text: str = '', format: str = 'turtle',
+               use_bn: bool = False) -> Job:
+        '''Spools the input written by write_input(path) and queues its conversion with a mapping file or text'''
+        self.expire()
+        with self.lock:
+            if self.pending() >= self.workers + self.max_queued:
+                raise QueueFull(self.retry_after)
+            job_id = uuid.uuid4().hex
+            job = self.jobs[job_id] = Job(job_id, str(self.spool_dir / job_id), format=format, created=time.time())
+        try:
+            job_dir = Path(job.dir)
+            job_dir.mkdir(parents=True)
+            write_input(job_dir / 'input.xml')
+            if mapping_text:
+                mapping_path = job_dir / 'mapping.x3ml'
+                mapping_path.write_text(mapping_text, encoding='utf-8')
+            future = self._pool().submit(convert_job, job.dir, str(mapping_path), format, use_bn)
+        except BaseException as ex:
+            self._finish(job, ex)
+            raise
+        future.add_done_callback(lambda f: self._finish(job, f.exception()))
+        return job
+
+    def _finish(self, job: Job, error) -> None:
+        job.error = str(error) if error else ''
+        job.finished = time.time()
+        job.status = 'failed' if error else 'done'
+        (Path(job.dir) / 'input.xml').unlink(missing_ok=True)
+
+    def get(self, job_id: str) -> Job | None:
+        '''Returns a job by id'''
+        job = self.jobs.get(job_id)
+        if job and job.status == 'queued' and (Path(job.dir) / 'started').exists():
+            job.status = 'running'
+        return job
+
+    def remove(self, job_id: str) -> bool:
+        '''Removes a finished job and its files'''
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in ('queued', 'running'):
+                return False
+            del self.jobs[job_id]
+        shutil.rmtree(job.dir, ignore_errors=True)
+        return True
+
+    def expire(self) -> None:
+        '''Removes the jobs finished more than ttl seconds ago'''
+        now = time.time()
+        for job in list(self.jobs.values()):
+            if job.finished and now - job.finished > self.ttl:
+                self.remove(job.id)
+
+    def shutdown(self) -> None:
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
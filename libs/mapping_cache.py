@@ -0,0 +1,151 @@
+import os
+import sys
+import pickle
+import hashlib
+import threading
+import tempfile
+from pathlib import Path
+from collections import OrderedDict
+import libs.x3ml as x3ml
+from libs.metrics import NULL_METRICS
+
+
+def text_key(text: str | bytes) -> str:
+    '''Returns a hash key of a mapping text'''
+    data = text.encode('utf-8') if isinstance(text, str) else text
+    return hashlib.sha256(data).hexdigest()
+
+
+class MappingCache():
+    '''LRU cache of compiled mappings keyed by a hash of the mapping text, evicted by total text size'''
+
+    def __init__(self, max_size: int = 32 * 2**20, metrics=NULL_METRICS):
+        self.max_size = max_size
+        self.metrics = metrics
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def __len__(self): return self.entries.__len__()
+
+    def get(self, text: str | bytes, build=None) -> x3ml.Mappings:
+        '''Returns the compiled mappings of a text, built by build() or parsed as X3ML on a miss'''
+        key = text_key(text)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                self.metrics.cache('mapping', hits=1)
+                return self.entries[key][0]
+            self.misses += 1
+        self.metrics.cache('mapping', misses=1)
+        with self.metrics.time('mapping_load'):
+            mappings = build() if build else x3ml.Mappings.from_str(text)
+        self._put(key, mappings, len(text))
+        return mappings
+
+    def get_file(self, file_path) -> x3ml.Mappings:
+        '''Returns the compiled mappings of a file, which is only read again after a change'''
+        p = Path(file_path)
+        stat = p.stat()
+        version = (stat.st_mtime_ns, stat.st_size)
+        recent = self.files.get(p)
+        if recent and recent[0] == version:
+            with self.lock:
+                if recent[1] in self.entries:
+                    self.hits += 1
+                    self.entries.move_to_end(recent[1])
+                    self.metrics.cache('mapping', hits=1)
+                    return self.entries[recent[1]][0]
+        text = p.read_text(encoding='UTF-8')
+        self.files[p] = (version, text_key(text))
+        return self.get(text)
+
+    def _put(self, key: str, mappings: x3ml.Mappings, size: int) -> None:
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (mappings, size)
+                self.size += size
+            # Evict least recently used entries, but keep the new one
+            while self.size > self.max_size and len(self.entries) > 1:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+
+    def stats(self) -> dict:
+        '''Returns the cache counters'''
+        with self.lock:
+            total = self.hits + self.misses
+            return {'entries': len(self.entries), 'size': self.size, 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+CACHE_FORMAT = 1
+'''Version of the pickled mappings on disk'''
+
+
+def code_version() -> str:
+    '''Returns a hash of the mapping code and the Python version, pickles of other versions are not loaded'''
+    data = Path(x3ml.__file__).read_bytes() + f'{CACHE_FORMAT} {sys.version_info[:2]}'.encode()
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def default_cache_dir() -> Path:
+    '''Returns $LIDO2RDF_CACHE, else lido2rdf in $XDG_CACHE_HOME or ~/.cache'''
+    if cache_dir := os.environ.get('LIDO2RDF_CACHE'):
+        return Path(cache_dir)
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'lido2rdf'
+
+
+class DiskCache():
+    '''Compiled mappings pickled in a directory, keyed by a hash of the mapping file and the code version
+
+    A warm start unpickles the mappings and compiles their xpaths instead of parsing the X3ML file.
+    Unreadable entries are rebuilt, an unwritable directory only disables the cache.
+    '''
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.version = code_version()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}-{self.version}.pickle'
+
+    def get_file(self, file_path) -> x3ml.Mappings:
+        '''Returns the compiled mappings of a file, unpickled if they were cached before'''
+        data = Path(file_path).read_bytes()
+        path = self.path(text_key(data))
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f).compile()
+        except FileNotFoundError:
+            pass
+        except Exception as ex:
+            print(f'Rebuilding cached mappings {path}: {ex}', file=sys.stderr)
+        mappings = x3ml.Mappings.from_str(data.decode('utf-8'))
+        self._put(path, mappings)
+        return mappings
+
+    def _put(self, path: Path, mappings: x3ml.Mappings) -> None:
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Written to a temporary file first, parallel runs never read a partial pickle
+            fd, part = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(mappings, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(part, path)
+            # Entries of the same file for other code versions are stale
+            for stale in self.cache_dir.glob(f'{path.name.rsplit("-", 1)[0]}-*.pickle'):
+                if stale != path:
+                    stale.unlink(missing_ok=True)
+        except OSError as ex:
+            print(f'Mappings not cached in {self.cache_dir}: {ex}', file=sys.stderr)
+
+
+def load_mappings(file_path, cache_dir=None) -> x3ml.Mappings:
+    '''Returns the compiled mappings of a file, through the disk cache in cache_dir if given'''
+    if cache_dir and Path(file_path).is_file():
+        return DiskCache(cache_dir).get_file(file_path)
+    return x3ml.Mappings.from_file(file_path)
@@ -0,0 +1,118 @@
+import time
+import bisect
+import threading
+import contextlib
+
+STAGES = ('mapping_load', 'xml_parse', 'mapping_evaluation', 'rdf_emit', 'rdf_serialize')
+'''Conversion stages timed by the converter, rdf_emit passes the triples of a record to a sink'''
+
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+'''Upper bounds in seconds of the stage histograms, most records take well below a millisecond per stage'''
+
+COUNTERS = {'records': 'LIDO records converted', 'triples': 'RDF triples generated',
+            'input_bytes': 'LIDO bytes parsed', 'output_bytes': 'RDF bytes sent'}
+
+
+class Histogram():
+    '''Cumulative Prometheus histogram of observed values'''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name: str, labels: str) -> list:
+        '''Returns the bucket, sum and count samples'''
+        lines = []
+        total = 0
+        for bound, count in zip([*map(str, self.buckets), '+Inf'], self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        return lines + [f'{name}_sum{{{labels}}} {self.sum}', f'{name}_count{{{labels}}} {total}']
+
+
+class Metrics():
+    '''Collects stage latencies, counters and cache hits of conversions, rendered in the Prometheus text format'''
+
+    def __init__(self, buckets=BUCKETS):
+        self.stages = {stage: Histogram(buckets) for stage in STAGES}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.caches = {}
+        self.lock = threading.Lock()
+
+    def __reduce__(self):
+        # Worker processes cannot report to the registry of the parent
+        return NullMetrics, ()
+
+    @contextlib.contextmanager
+    def time(self, stage: str):
+        '''Observes the duration of a with block as stage'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.stages[stage].observe(seconds)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += n
+
+    def cache(self, name: str, hits: int = 0, misses: int = 0) -> None:
+        '''Counts the hits and misses of a cache'''
+        with self.lock:
+            counts = self.caches.setdefault(name, [0, 0])
+            counts[0] += hits
+            counts[1] += misses
+
+    def render(self) -> str:
+        '''Returns the metrics in the Prometheus text exposition format'''
+        lines = ['# HELP lido2rdf_stage_seconds Duration of conversion stages per call',
+                 '# TYPE lido2rdf_stage_seconds histogram']
+        with self.lock:
+            for stage, histogram in self.stages.items():
+                lines += histogram.lines('lido2rdf_stage_seconds', f'stage="{stage}"')
+            for name, value in self.counters.items():
+                lines += [f'# HELP lido2rdf_{name}_total {COUNTERS[name]}', f'# TYPE lido2rdf_{name}_total counter',
+                          f'lido2rdf_{name}_total {value}']
+            caches = sorted(self.caches.items())
+        for kind, help in (('hits', 'Cache hits'), ('misses', 'Cache misses')):
+            lines += [f'# HELP lido2rdf_cache_{kind}_total {help}', f'# TYPE lido2rdf_cache_{kind}_total counter']
+            lines += [f'lido2rdf_cache_{kind}_total{{cache="{name}"}} {counts[kind == "misses"]}' for name, counts in caches]
+        lines += ['# HELP lido2rdf_cache_hit_ratio Share of cache lookups that were hits',
+                  '# TYPE lido2rdf_cache_hit_ratio gauge']
+        lines += [f'lido2rdf_cache_hit_ratio{{cache="{name}"}} {hits / (hits + misses) if hits + misses else 0.0}'
+                  for name, (hits, misses) in caches]
+        return '\n'.join(lines) + '\n'
+
+
+class NullMetrics(Metrics):
+    '''Discards all measurements, the default of converters and caches'''
+
+    def __init__(self):
+        pass
+
+    def time(self, stage: str):
+        return contextlib.nullcontext()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        pass
+
+    def count(self, name: str, n: int = 1) -> None:
+        pass
+
+    def cache(self, name: str, hits: int = 0, misses: int = 0) -> None:
+        pass
+
+    def render(self) -> str:
+        return ''
+
+
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,424 @@
+import re
+import os
+import json
+import time
+import contextlib
+import html
+import queue
+import datetime
+import tempfile
+import threading
+import urllib.parse as ulp
+from lxml import etree
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+
+
+OAI_SCHEMA_URL = 'http://www.openarchives.org/OAI/2.0/'
+RESUMPTION_TAG = f'{{{OAI_SCHEMA_URL}}}resumptionToken'
+DATE_TAG = f'{{{OAI_SCHEMA_URL}}}datestamp'
+HEADER_TAG = f'{{{OAI_SCHEMA_URL}}}header'
+IDENTIFIER_TAG = f'{{{OAI_SCHEMA_URL}}}identifier'
+
+
+def oai_url(server_url: str, oai_cmd: str) -> str:
+    '''Returns the URL of an OAI-PMH request'''
+    return server_url + f'?verb={oai_cmd}'
+
+
+def create_oai_cmd(args):
+    ''' Creates an oai-pmh cmd, e.g. ListRecords&from=2002-06-01T02:00:00Z&until=2002-06-01T03:00:00Z&metadataPrefix=lido'''
+    cmd = 'ListRecords'
+    if args:
+        if args.oai_from:
+            cmd += f'&from={args.oai_from}'
+        if args.oai_to:
+            cmd += f'&until={args.oai_to}'
+    cmd += '&metadataPrefix=lido'
+    return cmd
+
+
+def state_key(server_url: str, oai_cmd: str) -> str:
+    '''Returns the key of an endpoint in the state store, its list request without date range'''
+    params = [p for p in oai_cmd.split('&') if not p.startswith(('from=', 'until='))]
+    return f"{server_url}?verb={'&'.join(params)}"
+
+
+def cmd_params(oai_cmd: str) -> dict:
+    '''Returns the arguments of an OAI-PMH request'''
+    return dict(p.split('=', 1) for p in oai_cmd.split('&')[1:] if '=' in p)
+
+
+def with_params(oai_cmd: str, **params) -> str:
+    '''Returns a request with the non-empty params set, replacing its arguments of the same name'''
+    params = {k: v for k, v in params.items() if v}
+    kept = [p for p in oai_cmd.split('&') if p.split('=', 1)[0] not in params]
+    return '&'.join(kept + [f'{k}={v}' for k, v in params.items()])
+
+
+def with_from(oai_cmd: str, datestamp: str) -> str:
+    '''Returns a list request starting at a datestamp, unless it already has a start'''
+    if not datestamp or '&from=' in oai_cmd:
+        return oai_cmd
+    return f'{oai_cmd}&from={datestamp}'
+
+
+def delta_folder(rdf_folder, oai_cmd: str) -> str:
+    '''Returns the subfolder of rdf_folder for an incremental harvest, named by its start datestamp'''
+    since = cmd_params(oai_cmd).get('from', '')
+    return f"{str(rdf_folder).rstrip('/')}/{'since-' + since.replace(':', '-') if since else 'full'}"
+
+
+@dataclass
+class Header:
+    '''Header of an OAI-PMH record, deleted records have no metadata'''
+    identifier: str = ''
+    datestamp: str = ''
+    deleted: bool = False
+
+    @classmethod
+    def from_elem(cls, elem):
+        return cls(elem.findtext(IDENTIFIER_TAG, '').strip(), elem.findtext(DATE_TAG, '').strip(),
+                   elem.get('status') == 'deleted')
+
+
+def write_tombstones(path, headers: list) -> int:
+    '''Writes the deleted records of headers as JSON lines, returns their number'''
+    deleted = [asdict(h) for h in headers if h.deleted]
+    if deleted:
+        Path(f'{path}.part').write_text(''.join(json.dumps(d) + '\n' for d in deleted), encoding='utf-8')
+        os.replace(f'{path}.part', path)
+    return len(deleted)
+
+
+@dataclass
+class StateStore:
+    '''Latest datestamp harvested per endpoint, stored in a JSON file'''
+    path: str = 'oai-state.json'
+    endpoints: dict = field(default_factory=dict)
+
+    def get(self, key: str) -> str:
+        return self.endpoints.get(key, {}).get('datestamp', '')
+
+    changed: set = field(default_factory=set)
+
+    def put(self, key: str, datestamp: str) -> None:
+        '''Records the latest datestamp of a completed harvest'''
+        if datestamp:
+            self.endpoints[key] = {'datestamp': datestamp, 'harvested': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+            self.changed.add(key)
+
+    def save(self) -> None:
+        '''Writes the changed endpoints, those saved by parallel harvests meanwhile are kept'''
+        with STATE_LOCK:
+            endpoints = self.read(self.path)
+            endpoints.update({k: self.endpoints[k] for k in self.changed})
+            part = f'{self.path}.part'
+            Path(part).write_text(json.dumps(endpoints, indent=2), encoding='utf-8')
+            os.replace(part, self.path)
+
+    @staticmethod
+    def read(path) -> dict:
+        return json.loads(Path(path).read_text(encoding='utf-8')) if Path(path).is_file() else {}
+
+    @classmethod
+    def load(cls, path):
+        '''Returns the state store of a file, empty if there is none'''
+        with STATE_LOCK:
+            return cls(str(path), cls.read(path))
+
+
+STATE_LOCK = threading.Lock()
+'''Serializes state store files of parallel harvests'''
+
+
+DAY_FORMAT = '%Y-%m-%d'
+SECONDS_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def parse_datestamp(datestamp: str) -> datetime.datetime:
+    '''Returns the time of a datestamp of day or seconds granularity'''
+    return datetime.datetime.strptime(datestamp, DAY_FORMAT if len(datestamp) == 10 else SECONDS_FORMAT)
+
+
+def date_windows(start: str, end: str, n: int) -> list:
+    '''Splits the inclusive range from start to end into at most n consecutive windows of the granularity of start'''
+    days = len(start) == 10
+    step = datetime.timedelta(days=1) if days else datetime.timedelta(seconds=1)
+    first, last = parse_datestamp(start), parse_datestamp(end)
+    if days:
+        last = last.replace(hour=0, minute=0, second=0)
+    units = (last - first) // step + 1
+    n = max(1, min(n, units))
+    bounds = [first + step * (units * i // n) for i in range(n + 1)]
+    format = DAY_FORMAT if days else SECONDS_FORMAT
+    return [(bounds[i].strftime(format), (bounds[i + 1] - step).strftime(format)) for i in range(n)]
+
+
+def default_fetcher(fetcher=None):
+    '''Returns the fetcher or a new one, the HTTP client is only imported by harvests'''
+    if fetcher is None:
+        from libs.http_fetch import Fetcher
+        fetcher = Fetcher()
+    return fetcher
+
+
+def identify(server_url: str, fetcher=None) -> dict:
+    '''Returns the texts of the Identify response of an endpoint by tag name'''
+    with default_fetcher(fetcher).open(oai_url(server_url, 'Identify')) as response:
+        root = etree.parse(response).getroot()
+    return {etree.QName(e).localname: (e.text or '').strip() for e in root.iterfind(f'{{{OAI_SCHEMA_URL}}}Identify/*')}
+
+
+def split_windows(server_url: str, oai_cmd: str, n: int, fetcher=None) -> list:
+    '''Returns n date windows of a request, its date range defaults to the earliest datestamp until now'''
+    params = cmd_params(oai_cmd)
+    start, end = params.get('from'), params.get('until')
+    if not start or not end:
+        info = identify(server_url, fetcher)
+        start = start or info.get('earliestDatestamp', '')
+        format = DAY_FORMAT if info.get('granularity') == 'YYYY-MM-DD' or len(start) == 10 else SECONDS_FORMAT
+        start = start[:10] if format == DAY_FORMAT else start
+        end = end or datetime.datetime.now(datetime.timezone.utc).strftime(format)
+    return date_windows(start, end, n)
+
+
+def partition_cmds(oai_cmd: str, sets: list = (), windows: list = ()) -> dict:
+    '''Returns the requests of the partitions of a harvest by sets and date windows, keyed by partition name'''
+    cmds = {}
+    for set_spec in sets or ['']:
+        for i, (start, end) in enumerate(windows or [('', '')]):
+            name = '_'.join(filter(None, [set_spec and 'set-' + re.sub(r'[^\w.-]', '_', set_spec),
+                                          start and f'window-{i:03d}']))
+            cmds[name] = with_params(oai_cmd, set=ulp.quote(set_spec, safe=':'), **{'from': start, 'until': end})
+    return cmds
+
+
+TOKEN_PATTERN = re.compile(rb'<(?:[\w.-]+:)?resumptionToken\b([^>]*?)(?:/>|>([^<]*)<)')
+ATTR_PATTERN = re.compile(rb'([\w.-]+)\s*=\s*"([^"]*)"')
+TOKEN_WINDOW = 2**16
+'''Bytes at the end of a page that are searched for the resumptionToken'''
+
+
+def resumption_token(data: bytes) -> tuple[str, dict]:
+    '''Returns the resumptionToken and its attributes of an OAI-PMH response, it is the last element of a list'''
+    matches = list(TOKEN_PATTERN.finditer(data, max(0, len(data) - TOKEN_WINDOW))) or list(TOKEN_PATTERN.finditer(data))
+    if not matches:
+        return '', {}
+    attrs, token = matches[-1].groups()
+    attrib = {k.decode(): html.unescape(v.decode()) for k, v in ATTR_PATTERN.findall(attrs)}
+    return html.unescape((token or b'').decode()).strip(), attrib
+
+
+CHUNK_SIZE = 2**16
+
+
+def put_until(items: queue.Queue, item, stopped: threading.Event) -> bool:
+    '''Puts an item into a bounded queue unless stopped is set first, a full queue would block forever'''
+    while not stopped.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class PageReader():
+    '''Reads a response, keeps its tail for the resumptionToken and tees it to a spool file'''
+
+    def __init__(self, response, spool=None):
+        self.response = response
+        self.spool = spool
+        self.tail = b''
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.response.read(size)
+        if self.spool:
+            self.spool.write(data)
+        self.tail = (self.tail + data)[-TOKEN_WINDOW:]
+        return data
+
+    def close(self) -> None:
+        pass
+
+
+class ChunkQueue():
+    '''Reads chunks that another thread puts into a bounded queue, b'' ends the stream and exceptions are raised'''
+
+    def __init__(self, depth: int = 16):
+        self.chunks = queue.Queue(depth)
+        self.buffer = b''
+        self.eof = False
+        self.closed = threading.Event()
+
+    def put(self, chunk) -> bool:
+        '''Puts a chunk, returns False if the reader closed the stream'''
+        return put_until(self.chunks, chunk, self.closed)
+
+    def _fill(self) -> None:
+        chunk = self.chunks.get()
+        if isinstance(chunk, BaseException):
+            raise chunk
+        self.eof = not chunk
+        self.buffer += chunk
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.eof and (not self.buffer or size < 0):
+            self._fill()
+        data = self.buffer if size < 0 else self.buffer[:size]
+        self.buffer = self.buffer[len(data):]
+        return data
+
+    def close(self) -> None:
+        self.closed.set()
+
+
+def pump(reader: PageReader, stream: ChunkQueue) -> None:
+    '''Copies a response to a chunk queue, errors are passed to its reader'''
+    try:
+        while chunk := reader.read(CHUNK_SIZE):
+            if not stream.put(chunk):
+                return
+        stream.put(b'')
+    except BaseException as ex:
+        stream.put(ex)
+        raise
+
+
+@dataclass
+class Page:
+    '''A page of an OAI-PMH list response, streamed from the server'''
+    index: int = 0
+    stream: object = None
+    reader: PageReader = None
+
+    def token(self) -> tuple[str, dict]:
+        '''Returns the resumptionToken and its attributes, known once the stream is read'''
+        return resumption_token(self.reader.tail)
+
+
+def spool_file(spool, index: int):
+    '''Opens the spool file of a page, or a null context without spool directory'''
+    return open(Path(spool) / f'page_{index:05d}.xml', 'wb') if spool else contextlib.nullcontext()
+
+
+def make_spool_dir(spool) -> str | None:
+    '''Creates a directory of a run in the spool directory, runs side by side get their own'''
+    if spool:
+        Path(spool).mkdir(parents=True, exist_ok=True)
+        return tempfile.mkdtemp(prefix=time.strftime('%Y%m%dT%H%M%S-'), dir=spool)
+    return None
+
+
+def fetch_pages(server_url: str, oai_cmd: str, spool=None, pumped: bool = False, index: int = 0, token: str = '',
+                fetcher=None):
+    '''Yields the streamed pages of an OAI-PMH list request, the next page is requested as soon as its token is known
+
+    Pumped pages are copied from the response by the fetching thread, else the consumer reads the response.
+    A harvest continues at page index with a resumption token.
+    '''
+    fetcher = default_fetcher(fetcher)
+    url = oai_url(server_url, f"ListRecords&resumptionToken={ulp.quote(token)}" if token else oai_cmd)
+    while url:
+        with fetcher.open(url) as response, spool_file(spool, index) as tee:
+            page = Page(index, reader=PageReader(response, tee))
+            if pumped:
+                page.stream = ChunkQueue()
+                yield page
+                pump(page.reader, page.stream)
+            else:
+                page.stream = page.reader
+                yield page
+                while page.reader.read(CHUNK_SIZE):
+                    pass
+        token, _ = page.token()
+        url = oai_url(server_url, f"ListRecords&resumptionToken={ulp.quote(token)}") if token else None
+        index += 1
+
+
+@dataclass
+class Checkpoint:
+    '''Progress of a harvest, saved after each completed page'''
+    server_url: str = ''
+    oai_cmd: str = ''
+    index: int = -1
+    token: str = ''
+    cursor: str = ''
+    complete_list_size: str = ''
+    datestamp: str = ''
+    done: bool = False
+
+    def update(self, page: Page, headers: list = ()):
+        '''Records a completed page and the latest datestamp of its records'''
+        self.datestamp = max([self.datestamp] + [h.datestamp for h in headers])
+        token, attrib = page.token()
+        self.index = page.index
+        self.token = token
+        self.cursor = attrib.get('cursor', '')
+        self.complete_list_size = attrib.get('completeListSize', '')
+        self.done = not token
+        return self
+
+    def save(self, path) -> None:
+        '''Writes the checkpoint, a crash leaves the previous one in place'''
+        part = f'{path}.part'
+        Path(part).write_text(json.dumps(asdict(self), indent=2), encoding='utf-8')
+        os.replace(part, path)
+
+    @classmethod
+    def load(cls, path):
+        '''Returns the checkpoint of a file, None if there is none'''
+        if Path(path).is_file():
+            return cls(**json.loads(Path(path).read_text(encoding='utf-8')))
+        return None
+
+
+class Prefetch():
+    '''Iterates over the items of an iterable that is consumed ahead by a thread, at most depth items are buffered'''
+    DONE = object()
+
+    def __init__(self, iterable, depth: int = 2):
+        self.items = queue.Queue(depth)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._produce, args=(iterable,), daemon=True)
+        self.thread.start()
+
+    def _put(self, item) -> bool:
+        return put_until(self.items, item, self.stopped)
+
+    def _produce(self, iterable) -> None:
+        try:
+            for item in iterable:
+                if not self._put((item, None)):
+                    return
+        except BaseException as ex:
+            self._put((self.DONE, ex))
+        else:
+            self._put((self.DONE, None))
+
+    def __iter__(self):
+        try:
+            while True:
+                item, ex = self.items.get()
+                if item is self.DONE:
+                    if ex:
+                        raise ex
+                    return
+                yield item
+        finally:
+            self.stopped.set()
+
+
+def prefetch(iterable, depth: int = 2):
+    '''Returns the iterable consumed ahead by a thread, or the iterable itself for depth 0'''
+    return Prefetch(iterable, depth) if depth > 0 else iterable
+
+
+def harvest(pages, convert, write, depth: int = 2) -> int:
+    '''Runs the fetch, convert and write stages of a harvest in threads connected by queues of depth pages'''
+    count = 0
+    for result in prefetch(map(convert, prefetch(pages, depth)), depth):
+        write(result)
+        count += 1
+    return count
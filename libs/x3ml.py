@@ -1,9 +1,10 @@
 #!.venv/bin/python
 from lxml import etree
 import sys
+import time
 import json
 from pathlib import Path
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, asdict
 import re
 from enum import auto, Enum
 import csv
@@ -84,23 +85,92 @@ def match_attr(path: str):
     return re.search(r'\[@(.*)\]', path)
 
 
+def attr_filter(path: str) -> str:
+    '''Returns the attribute name of an xpath filter, pattern [@attr]'''
+    return apply_valid_arg(lambda m: m.group(1), match_attr(path), '')
+
+
+def compile_xpath(path: str) -> etree.XPath:
+    '''Compiles an xpath with Lido namespaces'''
+    return etree.XPath(path, namespaces=used_namespaces)
+
+
 def xpath_lido(elem: etree.Element, path_to_subs: str) -> list:
     '''Wrapper for xpath with Lido namespaces'''
     sub_elements = elem.xpath(path_to_subs, namespaces=used_namespaces)
-    if match := match_attr(path_to_subs):  # has attribute filter, pattern [@attr]
-        if elem.text:
-            elem.text = elem.text.strip()
-        if not elem.text:
-            transform_subs(match.group(1), sub_elements)
+    return attr_to_text(elem, sub_elements, attr_filter(path_to_subs))
+
+
+def xpath_compiled(elem: etree.Element, xpath: etree.XPath, attr_name: str = '', record=None) -> list:
+    '''Same as xpath_lido for a compiled xpath and its attribute filter'''
+    return attr_to_text(elem, xpath(elem), attr_name, record)
+
+
+def attr_to_text(elem: etree.Element, sub_elements: list, attr_name: str, record=None) -> list:
+    '''Populates the text of sub-elements from an attribute filter, if the element has no text'''
+    if attr_name:  # has attribute filter, pattern [@attr]
+        record = record or Record()
+        if text := record.text(elem):
+            record.set_text(elem, text.strip())
+        if not record.text(elem):
+            transform_subs(attr_name, sub_elements, record)
     return sub_elements
 
 
-def transform_subs(attr_name: str, sub_elements):
+def transform_subs(attr_name: str, sub_elements, record=None):
     '''Transforms sub-elements by populating text from attribute'''
     if attr_name:  # has attribute filter, pattern [@attr]
+        record = record or Record()
         attr_name = expand_with_namespaces(attr_name)
         for elem in sub_elements:
-            elem.text = elem.get(attr_name)
+            record.set_text(elem, elem.get(attr_name))
+
+
+@dataclass
+class Record:
+    '''Evaluation state of LIDO records: element paths, local IDs and, if read-only, derived texts
+
+    Without a root, the paths of the enclosing lido:lido of an element are indexed on demand.
+    '''
+    root: etree.Element = None
+    read_only: bool = False
+    id_scheme: str = 'v1'
+    texts: dict = field(default_factory=dict)
+    paths: dict = field(default_factory=dict)
+    ids: dict = field(default_factory=dict)
+
+    def text(self, elem: etree.Element) -> str | None:
+        '''Returns the (derived) text of an element'''
+        return self.texts.get(elem, elem.text) if self.read_only else elem.text
+
+    def set_text(self, elem: etree.Element, text: str | None) -> None:
+        '''Sets a derived text, in the side table if read-only'''
+        if self.read_only:
+            self.texts[elem] = text
+        else:
+            elem.text = text
+
+    def local_id(self, elem: etree.Element, index: int) -> str:
+        '''Returns the local ID of an element, kept from its first call
+
+        ID scheme v1: the path of the element and the index of its match, v2: its indexed path in the record.
+        '''
+        if (local_id := self.ids.get(elem)) is None:
+            if elem not in self.paths:
+                self.paths.update(path_index(self.root if self.root is not None else record_root(elem)))
+            path, _, indexed_path = self.paths[elem]
+            local_id = self.ids[elem] = indexed_path if self.id_scheme == 'v2' else f'{path}/{index}'
+        return local_id
+
+
+def record_root(elem: etree.Element) -> etree.Element:
+    '''Returns the enclosing lido:lido of an element, else the root of its tree'''
+    tag = expand_with_namespaces('lido:lido')
+    if elem.tag == tag:
+        return elem
+    for ancestor in elem.iterancestors(tag):
+        return ancestor
+    return elem.getroottree().getroot()
 
 
 def full_path(elem):
@@ -112,6 +182,24 @@ def full_path(elem):
     return tags
 
 
+def path_index(root: etree.Element) -> dict:
+    '''Maps all elements below root to their interned full path, sibling index and indexed path, in one traversal'''
+    lido_ns = f"{{{used_namespaces.get('lido', '')}}}"
+    path = full_path(root)
+    index = {root: (path, 1, path)}
+    stack = [root]
+    while stack:
+        parent = stack.pop()
+        parent_path, _, parent_id = index[parent]
+        counts = {}
+        for elem in parent.iterchildren(etree.Element):
+            tag = elem.tag.replace(lido_ns, '')
+            counts[tag] = position = counts.get(tag, 0) + 1
+            index[elem] = (sys.intern(f'{parent_path}/{tag}'), position, f'{parent_id}/{tag}[{position}]')
+            stack.append(elem)
+    return index
+
+
 ############################################################################################################################
 
 DOMAIN_SN_PATH = './domain/source_node'
@@ -138,15 +226,38 @@ def find_gen(elem: etree.Element) -> str | None:
 
 
 ############################################################################################################################
+class CompiledXPath():
+    '''Mixin for objects with compiled xpaths, which are dropped when pickled and compiled again on demand'''
+    XPATHS = ('_xpath', '_elements')
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in self.XPATHS}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.update({k: None for k in self.XPATHS if hasattr(type(self), k)})
+
+
 @dataclass
-class ID_Host():
+class ID_Host(CompiledXPath):
     '''Host for ID tags'''
     tag: str
+    _xpath: etree.XPath = field(default=None, init=False, repr=False, compare=False)
+    _attr: str = field(default='', init=False, repr=False, compare=False)
+
+    def compile(self):
+        '''Compiles the xpath to the ID elements'''
+        if self.tag:
+            self._xpath = compile_xpath(f"./{self.tag}")
+            self._attr = attr_filter(self.tag)
+        return self
 
-    def elements(self, elem: etree.Element) -> list:
+    def elements(self, elem: etree.Element, record=None) -> list:
         '''Returns child elements'''
         if self.tag:
-            return xpath_lido(elem, f"./{self.tag}")
+            if self._xpath is None:
+                self.compile()
+            return xpath_compiled(elem, self._xpath, self._attr, record)
         return []
 
 
@@ -154,12 +265,22 @@ class ID_Host():
 class ID_Host_List():
     '''Host for multiple ID tags'''
     tags: list = field(default_factory=list)
+    hosts: list = field(default_factory=list, init=False, repr=False, compare=False)
 
-    def elements(self, elem: etree.Element) -> list:
+    def __post_init__(self):
+        self.hosts = [ID_Host(tag=tag) for tag in self.tags]
+
+    def compile(self):
+        '''Compiles the xpaths to the ID elements'''
+        for host in self.hosts:
+            host.compile()
+        return self
+
+    def elements(self, elem: etree.Element, record=None) -> list:
         '''Returns all child elements from multiple tags'''
         all_elems = []
-        for tag in self.tags:
-            if elems := ID_Host(tag=tag).elements(elem):
+        for host in self.hosts:
+            if elems := host.elements(elem, record):
                 all_elems += elems
         return all_elems
 
@@ -198,18 +319,25 @@ def load_lido_map(fname='./lido-id-map.json'):
                 LIDO_ID_MAP[k] = ID_Host(tag=w)
 
 
-def get_ID_elements(elem):
+def compile_lido_map():
+    '''Compiles the xpaths of all ID hosts'''
+    for id_host in LIDO_ID_MAP.values():
+        id_host.compile()
+
+
+def get_ID_elements(elem, record=None):
     '''Returns all ID child elements'''
     tag = compress_with_namespaces(elem.tag)
     if id_host := LIDO_ID_MAP.get(tag):
-        return id_host.elements(elem)
+        return id_host.elements(elem, record)
     return []
 
 
-def get_IDs(elem):
+def get_IDs(elem, record=None):
     '''Returns all ID values from an element'''
-    id_elems = get_ID_elements(elem)
-    return [e.text for e in id_elems if not_none(e.text)]
+    record = record or Record()
+    id_elems = get_ID_elements(elem, record)
+    return [text for e in id_elems if not_none(text := record.text(e))]
 
 
 ############################################################################################################################
@@ -232,7 +360,8 @@ class Info:
         '''Creates an Info object from an element'''
         index = kw.get('index', -1)
         id_attr = kw.get('id_attr')
-        text = elem.text or ''
+        record = kw.get('record') or Record()
+        text = record.text(elem) or ''
         lang = elem.get(expand_with_namespaces('xml:lang'), '')
         lido_type = elem.get(expand_with_namespaces('lido:type'), '')
         about = elem.get(expand_with_namespaces('rdf:about'), '')
@@ -240,7 +369,7 @@ class Info:
 
         info = cls(text=text, attrib=elem.attrib, index=index, lang=lang, lido_type=lido_type, map_class=map_class, rdf_about=about)
         # Priority of ID assignment
-        if ids := get_IDs(elem):
+        if ids := get_IDs(elem, record):
             # Has an explicit ID
             info.mode = IDMode.LIDO_ID
             info.id = ids[0].strip()
@@ -251,11 +380,7 @@ class Info:
         elif len(elem) > 0 and not text:
             # Has subelements, use path as ID
             info.mode = IDMode.LOCAL_ID
-            if recent_id := elem.get('n4o_id'):
-                info.id = recent_id
-            else:
-                info.id = full_path(elem) + '/'+str(index)
-                elem.set('n4o_id', info.id)
+            info.id = record.local_id(elem, index)
         else:
             # Just text
             info.mode = IDMode.NONE
@@ -275,7 +400,7 @@ class SourceMode(Enum):
 
 
 @dataclass
-class ExP:
+class ExP(CompiledXPath):
     '''Linking of entity and path'''
     path: str = ''
     entity: str = ''
@@ -283,6 +408,8 @@ class ExP:
     generator: str = ''
     source_mode: SourceMode = SourceMode.S
     path_attr: str = ''
+    _xpath: etree.XPath = field(default=None, init=False, repr=False, compare=False)
+    _attr: str = field(default='', init=False, repr=False, compare=False)
 
     def __post_init__(self):
         if self.source_mode == SourceMode.S:
@@ -298,19 +425,34 @@ class ExP:
         '''Tests if the entity is a literal'''
         return self.entity.startswith('http')
 
-    def subs(self, elem, **kw) -> list:
+    def subs_path(self) -> str:
+        '''Returns the xpath to all subelements'''
+        return "." if self.isRoot() else f".//{self.path}"
+
+    def compile(self):
+        '''Compiles the xpath to all subelements'''
+        path = self.subs_path()
+        self._xpath = compile_xpath(path)
+        self._attr = attr_filter(path)
+        return self
+
+    def subs(self, elem, record=None, **kw) -> list:
         '''Returns all subelements for the given path'''
-        xpath = "." if self.isRoot() else f".//{self.path}"
-        return xpath_lido(elem, xpath)
+        if self._xpath is None:
+            return xpath_lido(elem, self.subs_path())
+        return xpath_compiled(elem, self._xpath, self._attr, record)
+
+    @classmethod
+    def fromText(cls, path: str | None, entity: str | None, source_mode: SourceMode, variable: str = '', gen: str = ''):
+        '''Creates an cls object from path and type texts'''
+        if entity and path:
+            return cls(path=path.strip(), entity=entity.strip(), variable=variable, generator=gen, source_mode=source_mode)
 
     @classmethod
     def fromElements(cls, path_elem: etree.Element, entity_elem: etree.Element, source_mode: SourceMode, variable: str = '', gen: str = ''):
         '''Creates an cls object from path and type elements'''
         if not_none(path_elem, entity_elem):
-            path = path_elem.text or ''
-            entity = entity_elem.text or ''
-            if entity and path:
-                return cls(path=path.strip(), entity=entity.strip(), variable=variable, generator=gen, source_mode=source_mode)
+            return cls.fromText(path_elem.text, entity_elem.text, source_mode, variable, gen)
 
 
 def stripPath(link: ExP, txt: str) -> str:
@@ -320,29 +462,67 @@ def stripPath(link: ExP, txt: str) -> str:
 ############################################################################################################################
 
 @dataclass
-class Condition():
+class Condition(CompiledXPath):
     '''Condition for filtering elements'''
     access: str = ''
     values: set = field(default_factory=set)
+    _xpath: etree.XPath = field(default=None, init=False, repr=False, compare=False)
+    _elements: etree.XPath = field(default=None, init=False, repr=False, compare=False)
+    _attr: str = field(default='', init=False, repr=False, compare=False)
 
     def add(self, path, value):
         self.access = path
         self.values.add(value)
+        self._xpath = None
+
+    def isText(self) -> bool:
+        '''Tests if the access path selects text values'''
+        return self.access.endswith('/text()')
+
+    def compile(self):
+        '''Compiles the access path, a text xpath or an attribute label'''
+        if self.values:
+            if self.isText():
+                self._xpath = compile_xpath(f"./{self.access}")
+                self._elements = compile_xpath(f"./{self.access.removesuffix('/text()')}")
+            else:
+                self._attr = expand_with_namespaces(self.access)
+        return self
 
-    def isValid(self, elem) -> bool:
+    def isValid(self, elem, record=None) -> bool:
         if len(self.values) > 0:
-            if self.access.endswith('/text()'):
-                pathValues = elem.xpath(f"./{self.access}", namespaces=used_namespaces)
+            if self.isText():
+                if self._xpath is None:
+                    pathValues = elem.xpath(f"./{self.access}", namespaces=used_namespaces)
+                elif record and record.read_only:
+                    # Derived texts are not in the tree
+                    pathValues = [record.text(e) for e in self._elements(elem)]
+                else:
+                    pathValues = self._xpath(elem)
                 return self.values.intersection(pathValues) != set()
             else:
                 # assume path as an attribute label
-                attrName = expand_with_namespaces(self.access)
+                attrName = self._attr or expand_with_namespaces(self.access)
                 attrValue = elem.get(attrName, '')
                 return attrValue in self.values
         return True
 
 
 ############################################################################################################################
+@dataclass
+class EvalStats:
+    '''Wall time, matched elements and produced triples of a profiled mapping or link'''
+    calls: int = 0
+    seconds: float = 0.0
+    elements: int = 0
+    triples: int = 0
+
+    def add(self, seconds: float, elements: int) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.elements += elements
+
+
 @dataclass
 class PO_Data:
     '''Data for a single PO'''
@@ -350,6 +530,7 @@ class PO_Data:
     O: ExP = None
     infos: list = field(default_factory=list)
     valid: bool = False
+    stats: EvalStats = None
 
 
 @dataclass
@@ -358,13 +539,26 @@ class PO():
     P: ExP = None
     O: ExP = None
     condition: Condition = field(default_factory=Condition)
+    stats: EvalStats = field(default=None, repr=False, compare=False)
+
+    def isValid(self, elem, record=None):
+        return self.condition.isValid(elem, record)
 
-    def isValid(self, elem):
-        return self.condition.isValid(elem)
+    def compile(self):
+        '''Compiles the xpaths of object and condition'''
+        self.O.compile()
+        self.condition.compile()
+        return self
 
-    def evaluate(self, elem):
-        infos = [Info.from_elem(e, index=i) for i, e in enumerate(self.O.subs(elem, tag='O'))]
-        return PO_Data(P=self.P, O=self.O, infos=infos, valid=self.isValid(elem))
+    def evaluate(self, elem, record=None):
+        # Local IDs are kept in the record, all elements need the same one
+        record = record or Record()
+        start = time.perf_counter() if self.stats else 0.0
+        infos = [Info.from_elem(e, index=i, record=record) for i, e in enumerate(self.O.subs(elem, record, tag='O'))]
+        data = PO_Data(P=self.P, O=self.O, infos=infos, valid=self.isValid(elem, record), stats=self.stats)
+        if self.stats:
+            self.stats.add(time.perf_counter() - start, len(infos))
+        return data
 
 
 ############################################################################################################################
@@ -375,6 +569,7 @@ class Mapping_Data:
     po_data_list: list = field(default_factory=list)
     valid: bool = False
     info: Info = field(default_factory=Info)
+    stats: EvalStats = None
 
 
 @dataclass
@@ -384,16 +579,34 @@ class Mapping:
     POs: list = field(default_factory=list)
     condition: Condition = field(default_factory=Condition)
     intermediates: list = field(default_factory=list)
-
-    def isValid(self, elem):
-        return self.condition.isValid(elem)
-
-    def evaluate_n(self, elem, i):
-        po_data_list = [po.evaluate(elem) for po in self.POs]
-        return Mapping_Data(S=self.S, po_data_list=po_data_list, valid=self.isValid(elem), info=Info.from_elem(elem, index=i, id_attr=self.S.path_attr))
-
-    def evaluate(self, elem):
-        return [self.evaluate_n(e, i) for i, e in enumerate(self.S.subs(elem, tag='S'))]
+    stats: EvalStats = field(default=None, repr=False, compare=False)
+
+    def isValid(self, elem, record=None):
+        return self.condition.isValid(elem, record)
+
+    def compile(self):
+        '''Compiles the xpaths of subject, condition and all POs'''
+        self.S.compile()
+        self.condition.compile()
+        for po in self.POs:
+            po.compile()
+        return self
+
+    def evaluate_n(self, elem, i, record=None):
+        po_data_list = [po.evaluate(elem, record) for po in self.POs]
+        info = Info.from_elem(elem, index=i, id_attr=self.S.path_attr, record=record)
+        return Mapping_Data(S=self.S, po_data_list=po_data_list, valid=self.isValid(elem, record), info=info, stats=self.stats)
+
+    def evaluate(self, elem, record=None):
+        # Local IDs are kept in the record, all elements need the same one
+        record = record or Record()
+        if self.stats is None:
+            return [self.evaluate_n(e, i, record) for i, e in enumerate(self.S.subs(elem, record, tag='S'))]
+        # Profiled: the time of a mapping includes its links
+        start = time.perf_counter()
+        data = [self.evaluate_n(e, i, record) for i, e in enumerate(self.S.subs(elem, record, tag='S'))]
+        self.stats.add(time.perf_counter() - start, len(data))
+        return data
 
     def addPO(self, po: PO):
         self.POs.append(po)
@@ -404,6 +617,52 @@ class Mapping:
 
 ############################################################################################################################
 
+class Profile():
+    '''Collects the evaluation stats of all mappings and links of compiled mappings until it is detached'''
+
+    def __init__(self, mappings):
+        self.mappings = mappings
+        for mapping in mappings:
+            mapping.stats = EvalStats()
+            for po in mapping.POs:
+                po.stats = EvalStats()
+
+    def detach(self) -> None:
+        for mapping in self.mappings:
+            mapping.stats = None
+            for po in mapping.POs:
+                po.stats = None
+
+    def rows(self) -> list:
+        '''Returns the stats of mappings (link None) and links keyed by their source paths, slowest first'''
+        rows = []
+        for i, mapping in enumerate(self.mappings):
+            if mapping.stats:
+                rows.append({'mapping': i, 'link': None, 'domain': mapping.S.path, 'path': '', 'range': '',
+                             'entity': mapping.S.entity, **asdict(mapping.stats)})
+            for j, po in enumerate(mapping.POs):
+                if po.stats:
+                    rows.append({'mapping': i, 'link': j, 'domain': mapping.S.path, 'path': po.P.path, 'range': po.O.path,
+                                 'entity': po.P.entity, **asdict(po.stats)})
+        return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+    def table(self) -> str:
+        '''Returns the rows as text table, links without triples are the candidates for removal'''
+        lines = [f'{"seconds":>10} {"calls":>8} {"elements":>9} {"triples":>9}  {"mapping":<8} source path']
+        for row in self.rows():
+            key = f'{row["mapping"]}' if row['link'] is None else f'{row["mapping"]}.{row["link"]}'
+            paths = row['domain'] if row['link'] is None else f'{row["domain"]} | {row["path"]} | {row["range"]}'
+            lines.append(f'{row["seconds"]:10.4f} {row["calls"]:8} {row["elements"]:9} {row["triples"]:9}  {key:<8} {paths}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, file_name) -> None:
+        '''Writes the rows as JSON for a .json file, else as table'''
+        with open(file_name, 'w', encoding='utf-8') as f:
+            if str(file_name).endswith('.json'):
+                json.dump(self.rows(), f, indent=2)
+            else:
+                f.write(self.table())
+
 
 @dataclass
 class Mappings:
@@ -415,13 +674,20 @@ class Mappings:
     def __getitem__(self, item): return self.mappings.__getitem__(item)
     def __add__(self, other): return Mappings(self.mappings + other.mappings)
 
+    def compile(self):
+        '''Compiles all xpaths of the mappings and the ID hosts'''
+        for mapping in self.mappings:
+            mapping.compile()
+        compile_lido_map()
+        return self
+
     @classmethod
     def from_element(cls, elem):
         '''Returns all mappings from an XML element'''
         return cls(mapping_list(elem))
 
     @classmethod
-    def from_str(cls, xml_str: str):
+    def from_str(cls, xml_str: str, compiled: bool = True):
         '''Returns all mappings from a string'''
         parser = etree.XMLPullParser(events=("end",), tag=('mapping'), encoding='UTF-8', remove_blank_text=True)
         parser.feed(xml_str)
@@ -429,15 +695,24 @@ class Mappings:
         for _, elem in parser.read_events():
             if not str2bool(elem.get('skip', 'false')):
                 mappings += cls.from_element(elem)
-        return mappings
+        return mappings.compile() if compiled else mappings
 
     @classmethod
-    def from_file(cls, fileName: str):
+    def from_model(cls, model):
+        '''Returns all mappings from an X3ml model (see x3ml_classes) without serializing it to XML'''
+        mappings = cls()
+        for model_mapping in model.mappings:
+            if not model_mapping.skip:
+                mappings += cls(model_mapping_list(model_mapping))
+        return mappings.compile()
+
+    @classmethod
+    def from_file(cls, fileName: str, compiled: bool = True):
         '''Returns all mappings from a file'''
         p = Path(fileName)
         if p.is_file():
             xml_str = p.read_text(encoding='UTF-8')
-            return cls().from_str(xml_str)
+            return cls().from_str(xml_str, compiled)
         return cls()
 
 
@@ -463,6 +738,28 @@ def mapping_list(elem) -> list:
         mappings.append(mapping)
     return mappings
 
+
+def model_mapping_list(model_mapping) -> list:
+    '''Reads a list of mappings from an X3ml model mapping, like mapping_list for its XML serialization'''
+    mappings = []
+    domain = model_mapping.domain
+    if subject_ExP := ExP.fromText(domain.path, domain.entity, SourceMode.S):
+        mapping = Mapping(subject_ExP)
+        for cond in domain.targetNode.conditions:
+            mapping.condition.add(cond.xpath, cond.value)
+        for link in model_mapping.links:
+            if not link.skip:
+                target_relation = link.path.targetRelation
+                if predicate_ExP := ExP.fromText(link.path.sourceRelation.path, target_relation.entity, SourceMode.P):
+                    varStr = link.range.targetNode.entity.attributes.get('variable', '')
+                    if object_ExP := ExP.fromText(link.range.path, link.range.entity, SourceMode.O, varStr):
+                        po = PO(P=predicate_ExP, O=object_ExP)
+                        for cond in target_relation.conditions:
+                            po.condition.add(cond.xpath, cond.value)
+                        mapping.addPO(po)
+        mappings.append(mapping)
+    return mappings
+
 ############################################################################################################################
 
 
@@ -2,17 +2,23 @@
 
 """Converts LIDO file to RDF """
 
+from __future__ import annotations
 import re
+import os
 import argparse
-from sys import stdin, stderr, exit
+from sys import stdin, stdout, stderr, exit
 from io import BytesIO
 from urllib.error import HTTPError, URLError
 from pathlib import Path
-from libs.LidoRDFConverter import LidoRDFConverter
+from contextlib import ExitStack
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from libs.LidoRDFConverter import LidoRDFConverter
 
 VERSION = "0.1.0"
 
-SUFFIX_FORMAT_MAP = {'ttl': 'turtle', 'nt': 'nt', 'json': 'json-ld', 'xml': 'xml'}
+SUFFIX_FORMAT_MAP = {'ttl': 'turtle', 'nt': 'nt', 'nq': 'nquads', 'json': 'json-ld', 'xml': 'xml'}
 '''Maps file suffixes to formats'''
 
 
@@ -30,9 +36,32 @@ def getValidFormat(format_str, file_name) -> str:
 def isURL(s): 
     return re.compile("^(https?|file):").match(s)
 
+def make_converter(mapping_file, **kw) -> LidoRDFConverter:
+    '''Creates a converter with the compiled mappings of a file'''
+    # Imported here, clients of the conversion daemon start without rdflib and lxml
+    from libs.mapping_cache import load_mappings
+    from libs.LidoRDFConverter import LidoRDFConverter
+    converter = LidoRDFConverter('', read_only=kw.get('read_only', False), id_scheme=kw.get('id_scheme', 'v1'))
+    converter.mappings = load_mappings(mapping_file, kw.get('cache_dir'))
+    return converter
+
+
 def lido2rdf(input, mapping_file, **kw) -> LidoRDFConverter.Graph | None:
     '''Applies a x3ml mapping to a LIDO file'''
-    converter = LidoRDFConverter(mapping_file)
+    from libs.x3ml import Profile
+    converter = make_converter(mapping_file, **kw)
+    if kw.get('profile'):
+        profile = Profile(converter.mappings)
+        try:
+            return lido2rdf_with(converter, input, **kw | {'workers': 1, 'profile': None})
+        finally:
+            profile.write(kw['profile'])
+            profile.detach()
+    return lido2rdf_with(converter, input, **kw)
+
+
+def lido2rdf_with(converter, input, **kw) -> LidoRDFConverter.Graph | None:
+    '''Converts a LIDO file or URL with a converter'''
     if isURL(input):
         return converter.process_url(input, **kw)
     else:
@@ -40,7 +69,58 @@ def lido2rdf(input, mapping_file, **kw) -> LidoRDFConverter.Graph | None:
             input = BytesIO()
             input.write(stdin.buffer.read())
             input.seek(0)
-        return converter.parse_file(input)[0]
+        if (workers := kw.get('workers', 1)) > 1:
+            return converter.parse_file_parallel(input, workers, kw.get('sink'))
+        return converter.parse_file(input, kw.get('sink'))[0]
+
+
+def lido2rdf_batch(sources: list, mapping_file, target: str, format: str, suffix: str, **kw) -> dict:
+    '''Converts the files of directories, glob patterns and @lists with one converter
+
+    With a directory target (an existing one or ending with /) each file gets its own output file, which is
+    skipped while it is newer than the file and the mapping unless forced. Else all files are merged into target.
+    Returns the numbers of converted, skipped and failed files.
+    '''
+    from libs.batch import expand_sources, convert_files, convert_merged
+    from libs.LidoRDFConverter import STREAM_FORMATS, make_sink
+    converter = make_converter(mapping_file, **kw)
+    files = expand_sources(sources)
+    workers = kw.get('workers', 1)
+    if os.path.isdir(target) or target.endswith('/'):
+        since = os.path.getmtime(mapping_file) if os.path.isfile(mapping_file) else 0.0
+        return convert_files(converter, files, target, format, suffix, since, kw.get('force', False), workers)
+    if format in STREAM_FORMATS and kw.get('stream', True):
+        with open(target, 'w', encoding='utf-8') as out:
+            sink = make_sink(format, out, kw.get('dedupe', 0))
+            counts = convert_merged(converter, files, sink, workers)
+            sink.result()
+    else:
+        sink = make_sink(format)
+        counts = convert_merged(converter, files, sink, workers)
+        converter.serialize(sink.result(), format, target)
+    return counts
+
+
+def make_fetcher(args):
+    '''Returns the HTTP fetcher of the arguments, imported only for URLs'''
+    from libs.http_fetch import Fetcher
+    return Fetcher(args.timeout, args.retries, host_limit=args.host_limit)
+
+
+def convert_remote(args):
+    '''Converts the source with the conversion daemon'''
+    from libs.daemon import convert_remote, default_socket, RemoteError
+    if isURL(args.source):
+        error('The conversion daemon converts files and stdin only')
+    request = {'mapping': os.path.abspath(args.mapping), 'format': getValidFormat(args.format, args.target),
+               'read_only': args.read_only, 'id_scheme': args.id_scheme}
+    with ExitStack() as stack:
+        source = stdin.buffer if args.source == '-' else stack.enter_context(open(args.source, 'rb'))
+        target = stdout.buffer if args.target in ('-', '/dev/stdout') else stack.enter_context(open(args.target, 'wb'))
+        try:
+            convert_remote(args.client or default_socket(), request, source, target)
+        except (RemoteError, OSError) as exception:
+            error(exception)
 
 
 def cli_convert():
@@ -52,8 +132,8 @@ def cli_convert():
 
     formats = ",".join(SUFFIX_FORMAT_MAP.keys())
 
-    parser.add_argument('source', metavar='LIDO-XML', nargs="?",
-                        default="-", help='LIDO file or URL (default: -)')
+    parser.add_argument('sources', metavar='LIDO-XML', nargs="*",
+                        help='LIDO file or URL, or directories, glob patterns and @lists of LIDO files (default: -)')
     parser.add_argument("-o", '--output', metavar="FILE", dest="target",
                         default='/dev/stdout', help="RDF output file (default: -)")
     parser.add_argument("-t", '--type', dest="format", default="ttl",
@@ -63,19 +143,111 @@ def cli_convert():
     parser.add_argument('--rdf-folder', metavar="DIR", dest="rdf_folder",
                         default='rdfData', help="RDF output folder for OAI-PMH processing (default: rdfData)")
 
+    parser.add_argument('--stream', action=argparse.BooleanOptionalAction, default=True,
+                        help="Write N-Triples/N-Quads record by record instead of serializing a graph (default: on), "
+                             "triples of nodes shared by records may repeat")
+    parser.add_argument('--dedupe', type=int, metavar="N", default=0,
+                        help="Drop streamed lines repeated within the last N lines (best effort, default: 0, off)")
+    parser.add_argument('--read-only', action='store_true', dest="read_only",
+                        help="Keep derived values in side tables instead of modifying the parsed LIDO")
+    parser.add_argument('-w', '--workers', type=int, metavar="N", default=1,
+                        help="Number of worker processes for local files (default: 1)")
+    parser.add_argument('--id-scheme', dest="id_scheme", default='v1',
+                        help="Scheme of minted IDs (v1: md5, v2: xxh3 and unique local IDs, needs the xxhash package) (default: v1)")
+    parser.add_argument('--cache-dir', metavar="DIR", dest="cache_dir",
+                        help="Cache the compiled mappings in DIR, e.g. ~/.cache/lido2rdf (default: $LIDO2RDF_CACHE, else off)")
+    parser.add_argument('--no-cache', action='store_const', const='', dest="cache_dir",
+                        help="Parse the X3ML mapping without the compiled mappings cache, also if $LIDO2RDF_CACHE is set")
+    parser.add_argument('--stats', action='store_true', help="Report the peak memory usage to stderr")
+    parser.add_argument('--profile', metavar="FILE",
+                        help="Write time, matched elements and triples per mapping and link to FILE (JSON for .json, else a table)")
+
+    parser.add_argument('--prefetch', type=int, metavar="N", default=2,
+                        help="OAI-PMH pages fetched ahead while converting (default: 2, 0: no pipelining)")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue an OAI-PMH harvest from the checkpoint next to the RDF output folder")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Harvest OAI-PMH records changed since the last complete harvest of the endpoint")
+    parser.add_argument('--state', metavar="FILE", default='oai-state.json',
+                        help="State file of incremental harvests (default: oai-state.json)")
+    parser.add_argument('--spool', metavar="DIR",
+                        help="Keep a copy of each received OAI-PMH page in a subdirectory of DIR per run")
+    parser.add_argument('--sets', type=lambda s: s.split(','), metavar="SET,...", default=[],
+                        help="Harvest these OAI-PMH sets, each into a partition of the RDF output folder")
+    parser.add_argument('--split', type=int, metavar="N", default=1,
+                        help="Harvest N date windows between --oai-from and --oai-to (default: earliest datestamp until now)")
+    parser.add_argument('--streams', type=int, metavar="N", default=4,
+                        help="Number of sets or date windows harvested at once (default: 4)")
+    parser.add_argument('--host-limit', type=int, metavar="N", dest="host_limit", default=2,
+                        help="Maximum number of concurrent requests per host (default: 2)")
+    parser.add_argument('--timeout', type=float, metavar="SECONDS", default=60,
+                        help="Timeout of HTTP requests (default: 60)")
+    parser.add_argument('--retries', type=int, metavar="N", default=5,
+                        help="Retries of failed HTTP requests with exponential backoff (default: 5)")
     parser.add_argument('-of', '--oai-from',  dest="oai_from",  default='', help="OAI from argument")
     parser.add_argument('-ot', '--oai-to',  dest="oai_to",  default='', help="OAI to argument")
 
+    parser.add_argument('--serve', metavar="SOCKET", nargs='?', const='',
+                        help="Run the conversion daemon on a Unix socket (default: $XDG_RUNTIME_DIR/lido2rdf.sock)")
+    parser.add_argument('--client', metavar="SOCKET", nargs='?', const='',
+                        help="Convert the LIDO file or stdin with the conversion daemon listening on SOCKET")
+    parser.add_argument('--force', action='store_true',
+                        help="Convert all files of a batch, also those with an up-to-date output file")
+
     args = parser.parse_args()
-    if args.source == "-" and stdin.isatty():
+    args.source = args.sources[0] if args.sources else '-'
+    if args.serve is not None:
+        from libs.daemon import serve, default_socket
+        try:
+            serve(args.serve or default_socket())
+        except OSError as exception:
+            error(exception)
+    elif args.source == "-" and stdin.isatty():
         parser.print_help()
+    elif args.client is not None:
+        if len(args.sources) > 1:
+            parser.error("argument --client: converts one LIDO file or stdin")
+        convert_remote(args)
     else:
+        from libs.LidoRDFConverter import STREAM_FORMATS, make_sink, peak_rss, ID_SCHEMES
+        if args.id_scheme not in ID_SCHEMES:
+            parser.error(f"argument --id-scheme: invalid choice: '{args.id_scheme}' (choose from {', '.join(ID_SCHEMES)})")
+        if args.cache_dir is None:
+            args.cache_dir = os.environ.get('LIDO2RDF_CACHE', '')
+        from libs.batch import is_batch
+        if len(args.sources) > 1 and any(isURL(source) for source in args.sources):
+            parser.error("argument LIDO-XML: a URL cannot be converted together with other sources")
+        if not isURL(args.source) and is_batch(args.sources):
+            try:
+                counts = lido2rdf_batch(args.sources, args.mapping, args.target, getValidFormat(args.format, args.target),
+                                        args.format, read_only=args.read_only,
+                                        id_scheme=args.id_scheme, cache_dir=args.cache_dir, workers=args.workers,
+                                        stream=args.stream, force=args.force, dedupe=args.dedupe)
+            except (OSError, ValueError) as exception:
+                error(exception)
+            print(', '.join(f'{n} {state}' for state, n in counts.items()), file=stderr)
+            if counts['failed']:
+                exit(1)
+            return
         try:
             format = getValidFormat(args.format, args.target)
-            if graph := lido2rdf(args.source, args.mapping, suffix=args.format, format=format, rdf_folder=args.rdf_folder, args=args):
-                graph.serialize(destination=args.target, format=format, encoding='utf-8')
-        except (HTTPError, URLError) as exception:
+            with ExitStack() as stack:
+                sink = None
+                if args.stream and format in STREAM_FORMATS:
+                    sink = make_sink(format, stack.enter_context(open(args.target, 'w', encoding='utf-8')), args.dedupe)
+                if graph := lido2rdf(args.source, args.mapping, suffix=args.format, format=format, rdf_folder=args.rdf_folder,
+                                      read_only=args.read_only, id_scheme=args.id_scheme,
+                                      workers=args.workers, profile=args.profile, prefetch=args.prefetch,
+                                      spool=args.spool, resume=args.resume,
+                                      state=args.state if args.incremental else None,
+                                      sets=args.sets, split=args.split, streams=args.streams,
+                                      fetcher=make_fetcher(args) if isURL(args.source) else None, cache_dir=args.cache_dir,
+                                      sink=sink, args=args):
+                    graph.serialize(destination=args.target, format=format, encoding='utf-8')
+        except (HTTPError, URLError, ValueError) as exception:
             error(exception)
+        if args.stats:
+            print(f'peak RSS: {peak_rss() / 2**20:.1f} MiB', file=stderr)
 
 
 if __name__ == "__main__":
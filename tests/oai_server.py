@@ -0,0 +1,125 @@
+'''Stand-in OAI-PMH server that serves synthetic LIDO records for tests and benchmarks'''
+import gzip
+import time
+import threading
+import urllib.parse as ulp
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LIDO_NS = 'http://www.lido-schema.org'
+OAI_NS = 'http://www.openarchives.org/OAI/2.0/'
+
+
+def make_record(i: int) -> str:
+    '''Returns a small LIDO record'''
+    return (f'<lido:lido xmlns:lido="{LIDO_NS}"><lido:lidoRecID lido:type="local">rec-{i}</lido:lidoRecID>'
+            f'<lido:descriptiveMetadata xml:lang="en"><lido:objectIdentificationWrap><lido:titleWrap>'
+            f'<lido:titleSet><lido:appellationValue>Title {i}</lido:appellationValue></lido:titleSet>'
+            f'</lido:titleWrap></lido:objectIdentificationWrap></lido:descriptiveMetadata></lido:lido>')
+
+
+class OAIServer():
+    '''Serves ListRecords pages of page_size records with resumption tokens, each response is delayed by delay seconds
+
+    Records get the datestamp in datestamps (by index) or DATESTAMP, those of the index set deleted are
+    served as deleted headers. Sets map set specs to record indexes. Requests with the resumption token fail_token get fail_status, failures times
+    (always if negative) and with a Retry-After header if retry_after is set. Responses are gzip compressed
+    if the client accepts it and compress is set. Connections are kept alive.
+    '''
+    DATESTAMP = '2024-01-01T00:00:00Z'
+
+    def __init__(self, records: list, page_size: int = 10, delay: float = 0.0):
+        self.records = records
+        self.page_size = page_size
+        self.delay = delay
+        self.requests = []
+        self.fail_token = None
+        self.fail_status = 500
+        self.failures = -1
+        self.retry_after = None
+        self.compress = True
+        self.clients = set()
+        self.datestamps = {}
+        self.deleted = set()
+        self.sets = {}
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self.server.server_port}/oai'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def record(self, i: int) -> str:
+        '''Returns the OAI-PMH record of a LIDO record'''
+        status = ' status="deleted"' if i in self.deleted else ''
+        header = (f'<header{status}><identifier>rec-{i}</identifier>'
+                  f'<datestamp>{self.datestamps.get(i, self.DATESTAMP)}</datestamp></header>')
+        return f'<record>{header}</record>' if status else f'<record>{header}<metadata>{self.records[i]}</metadata></record>'
+
+    def page(self, query: dict) -> bytes:
+        '''Returns the ListRecords response of a query, the resumption token keeps its arguments'''
+        start, since, until, set_spec = (query.get('resumptionToken', '0') + '@@@').split('@')[:4]
+        since, until, set_spec = since or query.get('from', ''), until or query.get('until', ''), set_spec or query.get('set', '')
+        selected = [i for i in range(len(self.records)) if self.datestamps.get(i, self.DATESTAMP)[:len(since)] >= since
+                    and (not until or self.datestamps.get(i, self.DATESTAMP)[:len(until)] <= until)
+                    and (not set_spec or i in self.sets[set_spec])]
+        start = int(start)
+        end = start + self.page_size
+        items = ''.join(self.record(i) for i in selected[start:end])
+        token = '@'.join([str(end), since, until, set_spec]).rstrip('@') if end < len(selected) else ''
+        return (f'<?xml version="1.0" encoding="UTF-8"?><OAI-PMH xmlns="{OAI_NS}"><ListRecords>{items}'
+                f'<resumptionToken completeListSize="{len(selected)}" cursor="{start}">{token}</resumptionToken>'
+                f'</ListRecords></OAI-PMH>').encode('utf-8')
+
+    def identify(self) -> bytes:
+        '''Returns the Identify response'''
+        earliest = min([self.datestamps.get(i, self.DATESTAMP) for i in range(len(self.records))], default=self.DATESTAMP)
+        return (f'<?xml version="1.0" encoding="UTF-8"?><OAI-PMH xmlns="{OAI_NS}"><Identify>'
+                f'<repositoryName>stand-in</repositoryName><baseURL>{self.url}</baseURL><protocolVersion>2.0</protocolVersion>'
+                f'<earliestDatestamp>{earliest}</earliestDatestamp><deletedRecord>persistent</deletedRecord>'
+                f'<granularity>YYYY-MM-DDThh:mm:ssZ</granularity></Identify></OAI-PMH>').encode('utf-8')
+
+    def _handler(self):
+        oai = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                query = dict(ulp.parse_qsl(ulp.urlsplit(self.path).query))
+                oai.requests.append(query)
+                oai.clients.add(self.client_address)
+                with oai.lock:
+                    oai.active += 1
+                    oai.max_active = max(oai.max_active, oai.active)
+                time.sleep(oai.delay)
+                with oai.lock:
+                    oai.active -= 1
+                if oai.fail_token and query.get('resumptionToken') == oai.fail_token and oai.failures != 0:
+                    oai.failures -= 1
+                    self.send_response(oai.fail_status)
+                    if oai.retry_after is not None:
+                        self.send_header('Retry-After', str(oai.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = oai.identify() if query.get('verb') == 'Identify' else oai.page(query)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml')
+                if oai.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
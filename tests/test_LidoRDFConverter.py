@@ -0,0 +1,168 @@
+import os
+import pytest
+import io
+import rdflib as RF
+import pickle
+import hashlib
+import libs.x3ml as x3ml
+from libs.LidoRDFConverter import LidoRDFConverter, NodeFactory, make_id_node, make_sink, nt_term
+
+
+def convert(lido_file, **kw):
+    converter = LidoRDFConverter('defaultMapping.x3ml', **kw)
+    graph, _ = converter.parse_file(lido_file)
+    return set(graph)
+
+
+LIDO_NS = 'http://www.lido-schema.org'
+
+EMPTY_MAPPING = '''<x3ml><mappings><mapping>
+  <domain>
+    <source_node>lido:unknown</source_node>
+    <target_node><entity><type>crm:E22_Human-Made_Object</type></entity></target_node>
+  </domain>
+</mapping></mappings></x3ml>'''
+
+
+def write_synthetic_lido(path, records):
+    '''Writes a lidoWrap file with small records'''
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<lido:lidoWrap xmlns:lido="{LIDO_NS}">\n')
+        for i in range(records):
+            f.write(f'<lido:lido><lido:lidoRecID lido:type="local">rec-{i}</lido:lidoRecID>'
+                    f'<lido:descriptiveMetadata xml:lang="en"><lido:objectIdentificationWrap><lido:titleWrap>'
+                    f'<lido:titleSet><lido:appellationValue>Title {i}</lido:appellationValue></lido:titleSet>'
+                    f'</lido:titleWrap></lido:objectIdentificationWrap></lido:descriptiveMetadata></lido:lido>\n')
+        f.write('</lido:lidoWrap>\n')
+
+
+def current_rss():
+    '''Returns the current resident set size in bytes'''
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class SamplingConverter(LidoRDFConverter):
+    '''Samples the RSS every 1000 records while parsing'''
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.records = 0
+        self.samples = []
+
+    def _process_lido_element(self, elem, graph):
+        if self.records % 1000 == 0:
+            self.samples.append(current_rss())
+        self.records += 1
+        super()._process_lido_element(elem, graph)
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/statm'), reason="needs /proc")
+def test_parse_file_memory_stays_flat(tmp_path):
+    records = 100_000
+    lido_file = tmp_path / 'big.xml'
+    write_synthetic_lido(lido_file, records)
+    converter = SamplingConverter.from_str(EMPTY_MAPPING)
+    converter.parse_file(str(lido_file))
+    samples = converter.samples
+    assert converter.records == records
+    growth = samples[-1] - samples[len(samples) // 10]
+    assert growth < 2 * 1024 * 1024
+
+
+@pytest.mark.parametrize('format', ['nt', 'nquads'])
+def test_streaming_sink_matches_graph(format):
+    converter = LidoRDFConverter('defaultMapping.x3ml')
+    graph, _ = converter.parse_file('example1.xml')
+    out = io.StringIO()
+    assert converter.parse_file('example1.xml', make_sink(format, out))[0] is None
+    dataset = RF.Dataset()
+    dataset.parse(data=out.getvalue(), format=format)
+    assert set((s, p, o) for s, p, o, _ in dataset.quads()) == set(graph)
+
+
+def test_nt_term_escapes_literals():
+    literal = RF.Literal('say "hi"\nback\\slash', lang='en')
+    line = f'<urn:s> <urn:p> {nt_term(literal)} .\n'
+    assert '\n' not in line[:-1]
+    assert next(iter(RF.Graph().parse(data=line, format='nt')))[2] == literal
+
+
+def test_parallel_conversion_is_deterministic():
+    converter = LidoRDFConverter('defaultMapping.x3ml')
+    serial, parallel = io.StringIO(), io.StringIO()
+    converter.parse_file('example2.xml', make_sink('nt', serial))
+    converter.parse_file_parallel('example2.xml', 2, make_sink('nt', parallel), chunk_size=3)
+    assert parallel.getvalue() == serial.getvalue()
+
+
+@pytest.mark.parametrize('lido_file', ['example1.xml', 'example2.xml'])
+def test_read_only_evaluation_parity(lido_file):
+    triples = convert(lido_file)
+    assert len(triples) > 0
+    assert convert(lido_file, read_only=True) == triples
+
+
+def test_read_only_evaluation_leaves_record_unchanged():
+    from lxml import etree
+    import libs.x3ml as x3ml
+    converter = LidoRDFConverter('defaultMapping.x3ml', read_only=True)
+    root = etree.parse('defaultLido.xml', etree.XMLParser(remove_blank_text=True)).getroot()
+    before = etree.tostring(root)
+    record = x3ml.Record(root=root, read_only=True)
+    for m in converter.mappings:
+        m.evaluate(root, record)
+    assert etree.tostring(root) == before
+    assert record.paths and record.texts
+
+
+def test_node_factory_memoizes_record_nodes():
+    nodes = NodeFactory()
+    nodes.begin('rec-1', x3ml.Mappings())
+    info = x3ml.Info(mode=x3ml.IDMode.LOCAL_ID, id='root/event[1]')
+    node = nodes.id_node(info)
+    assert nodes.id_node(x3ml.Info(mode=x3ml.IDMode.LOCAL_ID, id='root/event[1]')) is node
+    assert node == make_id_node(info, nodes.nsm, 'rec-1')
+    assert nodes.curie('crm:E5_Event') is nodes.curie('crm:E5_Event')
+    nodes.begin('rec-2', x3ml.Mappings())
+    assert nodes.id_node(info) != node
+
+
+def test_node_factory_resolves_mapping_curies():
+    nodes = NodeFactory()
+    mappings = x3ml.Mappings.from_file('defaultMapping.x3ml')
+    nodes.begin('', mappings)
+    assert nodes.curies['crm:E22_Man-Made_Object'] == RF.URIRef('http://www.cidoc-crm.org/cidoc-crm/E22_Man-Made_Object')
+    assert pickle.loads(pickle.dumps(nodes)).curies == {}
+
+
+def test_id_schemes():
+    with pytest.raises(ValueError):
+        NodeFactory(id_scheme='v0')
+    # v1 keeps the local IDs of earlier versions, the element path and the index of its first match
+    triples = convert('example1.xml')
+    nodes = {node for triple in triples for node in triple}
+    for path in ('lido/descriptiveMetadata/eventWrap/eventSet/event/0', 'lido/descriptiveMetadata/objectIdentificationWrap/'
+                 'objectMeasurementsWrap/objectMeasurementsSet/objectMeasurements/measurementsSet/0'):
+        label = f'DE-MUS-059918/dc00018494-{path}'
+        assert RF.URIRef(f'http://graph.nfdi4objects.net/id/{hashlib.md5(label.encode()).hexdigest()}') in nodes
+    assert (len(triples), len(convert('example2.xml'))) == (129, 4707)
+    pytest.importorskip('xxhash')
+    # v2 local IDs are indexed paths, elements of the same path get nodes of their own
+    v2 = convert('example1.xml', id_scheme='v2')
+    assert len(v2) == 133
+    assert any(str(s).startswith('http://graph.nfdi4objects.net/id/v2-') for s, _, _ in v2)
+
+
+def test_streaming_sink_drops_repeated_lines():
+    converter = LidoRDFConverter('defaultMapping.x3ml')
+    graph, _ = converter.parse_file('example2.xml')
+    out = io.StringIO()
+    converter.parse_file('example2.xml', make_sink('nt', out, max_seen=2**16))
+    lines = out.getvalue().splitlines()
+    assert len(lines) == len(set(lines)) == len(graph)
+    # Off by default, duplicates are only dropped within a record
+    out = io.StringIO()
+    converter.parse_file('example2.xml', make_sink('nt', out))
+    lines = out.getvalue().splitlines()
+    assert len(lines) > len(set(lines)) == len(graph)
@@ -0,0 +1,137 @@
+import io
+import json
+import time
+import pytest
+import rdflib as RF
+from rdflib.compare import isomorphic
+import app as service
+from libs.jobs import JobQueue
+from tests.oai_server import make_record
+
+
+@pytest.fixture
+def client():
+    service.app.config['TESTING'] = True
+    return service.app.test_client()
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    queue = JobQueue(tmp_path / 'jobs', workers=1, max_queued=0)
+    monkeypatch.setattr(service, 'JOBS', queue)
+    yield queue
+    queue.shutdown()
+
+
+def wait_for(client, job, timeout=60):
+    start = time.time()
+    while (status := client.get(job['status_url']).get_json())['status'] in ('queued', 'running'):
+        assert time.time() - start < timeout
+        time.sleep(0.1)
+    return status
+
+
+def test_convert_streams_ntriples(client):
+    with open('example1.xml', 'rb') as f:
+        lido = f.read()
+    expected = RF.Graph().parse(data=service.convert_lido_str(lido, service.dlftMappings(), format='nt'), format='nt')
+    response = client.post('/convert', data={'file': (io.BytesIO(lido), 'example1.xml'), 'format': 'nt'})
+    assert response.status_code == 200 and response.mimetype == 'application/n-triples'
+    assert response.is_streamed
+    assert isomorphic(RF.Graph().parse(data=response.data, format='nt'), expected)
+
+
+def test_convert_chunks_yield_per_record():
+    with open('example2.xml', 'rb') as f:
+        lido = f.read()
+    chunks = service.read_chunks(io.BytesIO(lido), 512)
+    rdf_chunks = list(service.convert_lido_chunks(chunks, service.dlftMappings(), format='nquads'))
+    assert len([c for c in rdf_chunks if c]) == 20
+    assert len(RF.Dataset().parse(data=''.join(rdf_chunks), format='nquads')) > 0
+
+
+def test_convert_reports_malformed_lido(client):
+    response = client.post('/convert', data=b'<lido:lido', content_type='application/xml')
+    assert response.status_code == 400 and response.get_json()['error']
+    turtle = client.post('/convert', data=open('example1.xml', 'rb').read(), content_type='application/xml')
+    assert turtle.status_code == 200 and len(RF.Graph().parse(data=turtle.data, format='turtle')) > 0
+
+
+def test_convert_batch_returns_results(client):
+    records = [make_record(i) for i in range(3)]
+    files = [(io.BytesIO(r.encode()), f'rec-{i}.xml') for i, r in enumerate(records)]
+    response = client.post('/convert/batch', data={'file': files + [(io.BytesIO(b'<lido:lido'), 'bad.xml')],
+                                                   'format': 'nt'})
+    results = response.get_json()['results']
+    assert [r['id'] for r in results] == ['rec-0.xml', 'rec-1.xml', 'rec-2.xml', 'bad.xml']
+    assert [r['status'] for r in results] == ['done', 'done', 'done', 'failed']
+    assert all(len(RF.Graph().parse(data=r['rdf'], format='nt')) > 0 for r in results[:3])
+
+
+def test_convert_batch_merges_ndjson(client):
+    with open('defaultMapping.x3ml') as f:
+        lines = [json.dumps({'mapping': f.read()})]
+    lines += [json.dumps({'id': i, 'lido': make_record(i)}) for i in range(3)] + [json.dumps({'lido': '<x'})]
+    # A document of two records and one repeating a record of another document
+    wrap = f'<lido:lidoWrap xmlns:lido="http://www.lido-schema.org">{make_record(3)}{make_record(4)}</lido:lidoWrap>'
+    lines += [json.dumps({'id': 'wrap', 'lido': wrap}), json.dumps({'id': 'again', 'lido': make_record(0)})]
+    response = client.post('/convert/batch?merge=true', data='\n'.join(lines), content_type='application/x-ndjson')
+    assert response.status_code == 200 and response.mimetype == 'application/n-quads'
+    text = response.get_data(as_text=True)
+    assert text.count('\n# 3: ') == 1
+    graphs = {}
+    for *triple, graph in RF.Dataset().parse(data=text, format='nquads').quads():
+        graphs.setdefault(graph, set()).add(tuple(triple))
+    assert len(graphs) == 5
+    triples = list(graphs.values())
+    # The two documents of record 0 have graphs of their own, the two records of wrap share one
+    assert sum(triples.count(t) == 2 for t in triples) == 2
+    assert max(map(len, triples)) == 2 * min(map(len, triples))
+
+
+
+@pytest.mark.parametrize('first', ['[1]', '"x"', '3'])
+def test_convert_batch_rejects_ndjson_without_object(client, first):
+    response = client.post('/convert/batch', data=first + '\n', content_type='application/x-ndjson')
+    assert response.status_code == 400 and response.get_json()['error']
+
+def test_metrics_count_conversions(client):
+    client.post('/convert', data={'file': (open('example2.xml', 'rb'), 'example2.xml'), 'format': 'nt'})
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    samples = dict(line.rsplit(' ', 1) for line in response.get_data(as_text=True).splitlines() if not line.startswith('#'))
+    assert float(samples['lido2rdf_records_total']) >= 20
+    assert float(samples['lido2rdf_triples_total']) > float(samples['lido2rdf_records_total'])
+    assert float(samples['lido2rdf_output_bytes_total']) > 0
+    for stage in ('xml_parse', 'mapping_evaluation', 'rdf_emit'):
+        assert float(samples[f'lido2rdf_stage_seconds_count{{stage="{stage}"}}']) > 0
+    assert 0 < float(samples['lido2rdf_cache_hit_ratio{cache="id_node"}']) < 1
+    assert 'lido2rdf_cache_hits_total{cache="mapping"}' in samples
+
+
+def test_job_converts_upload(client, jobs):
+    with open('example1.xml', 'rb') as f:
+        response = client.post('/jobs', data={'file': (f, 'example1.xml'), 'format': 'nt'})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert response.headers['Location'].endswith(job['status_url'])
+    # One running job fills the queue
+    busy = client.post('/jobs?format=nt', data=b'<lido/>', content_type='application/xml')
+    assert busy.status_code == 503 and busy.headers['Retry-After']
+    assert wait_for(client, job)['status'] == 'done'
+    result = client.get(job['result_url'])
+    assert result.status_code == 200 and result.mimetype == 'application/n-triples'
+    assert len(RF.Graph().parse(data=result.data, format='nt')) > 0
+    assert client.delete(job['status_url']).status_code == 204
+    assert client.get(job['status_url']).status_code == 404
+
+
+def test_job_reports_failure(client, jobs):
+    response = client.post('/jobs', data=b'<lido:lido', content_type='application/xml')
+    job = wait_for(client, response.get_json())
+    assert job['status'] == 'failed' and job['error']
+    assert client.get(job['result_url']).status_code == 409
+
+
+def test_job_requires_file(client, jobs):
+    assert client.post('/jobs', data={'format': 'nt'}, content_type='multipart/form-data').status_code == 400
@@ -0,0 +1,47 @@
+import io
+import os
+import threading
+import pytest
+import rdflib as RF
+from rdflib.compare import isomorphic
+from libs.daemon import ConversionServer, RemoteError, convert_remote
+from libs.LidoRDFConverter import LidoRDFConverter
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    server = ConversionServer(str(tmp_path / 'lido2rdf.sock'))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def remote(server, source: bytes, format='nt') -> bytes:
+    target = io.BytesIO()
+    request = {'mapping': os.path.abspath('defaultMapping.x3ml'), 'format': format}
+    convert_remote(server.socket_path, request, io.BytesIO(source), target)
+    return target.getvalue()
+
+
+def test_daemon_converts_like_cli(daemon):
+    with open('example2.xml', 'rb') as f:
+        lido = f.read()
+    expected = LidoRDFConverter('defaultMapping.x3ml').parse_file(io.BytesIO(lido))[0]
+    for format in ('nt', 'turtle'):
+        graph = RF.Graph().parse(data=remote(daemon, lido, format), format=format)
+        assert isomorphic(graph, expected)
+    # The mapping is parsed once
+    assert daemon.cache.stats()['misses'] == 1
+
+
+def test_daemon_reports_errors(daemon):
+    with pytest.raises(RemoteError, match='XMLSyntaxError'):
+        remote(daemon, b'<lido:lido')
+    assert remote(daemon, open('example1.xml', 'rb').read())
+
+
+def test_second_daemon_refuses_socket(daemon):
+    with pytest.raises(OSError, match='already listening'):
+        ConversionServer(daemon.socket_path)
+    assert os.path.exists(daemon.socket_path)
@@ -0,0 +1,84 @@
+import zlib
+import pytest
+from pathlib import Path
+from urllib.error import HTTPError
+from libs.http_fetch import Fetcher, Response, retry_after
+from libs.LidoRDFConverter import LidoRDFConverter
+from tests.oai_server import OAIServer, make_record
+
+
+class Raw():
+    '''Response stand-in with a body in small chunks'''
+
+    def __init__(self, body, encoding):
+        self.status = 200
+        self.headers = {'Content-Encoding': encoding}
+        self.chunks = [body[i:i + 7] for i in range(0, len(body), 7)]
+
+    def read(self, size):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize('wbits', [31, 15, -15])
+def test_response_decompresses(wbits):
+    body = b'<lido>' + b'x' * 1000 + b'</lido>'
+    compressor = zlib.compressobj(wbits=wbits)
+    data = compressor.compress(body) + compressor.flush()
+    response = Response(Raw(data, 'gzip' if wbits == 31 else 'deflate'))
+    assert b''.join(iter(lambda: response.read(100), b'')) == body
+
+
+def test_retry_after():
+    assert retry_after('3') == 3
+    assert retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert retry_after(None) is None
+    assert Fetcher(backoff=0.5, max_wait=3).wait(3) == 3
+    assert Fetcher(backoff=0.5).wait(1, {'Retry-After': '2'}) == 2
+
+
+def test_fetcher_keeps_connection_and_decompresses():
+    records = [make_record(i) for i in range(5)]
+    fetcher = Fetcher()
+    with OAIServer(records, page_size=10) as server:
+        for _ in range(3):
+            with fetcher.open(f'{server.url}?verb=ListRecords') as response:
+                assert response.headers['Content-Encoding'] == 'gzip'
+                assert response.read() == server.page({})
+    assert len(server.requests) == 3
+    assert len(server.clients) == 1
+
+
+def test_fetcher_retries_with_retry_after():
+    with OAIServer([make_record(0)]) as server:
+        server.fail_token, server.fail_status, server.failures, server.retry_after = '1', 503, 2, 0
+        with Fetcher(backoff=10).open(f'{server.url}?verb=ListRecords&resumptionToken=1') as response:
+            assert b'OAI-PMH' in response.read()
+        assert len(server.requests) == 3
+        server.failures = -1
+        with pytest.raises(HTTPError) as error:
+            Fetcher(retries=1, backoff=0).open(f'{server.url}?verb=ListRecords&resumptionToken=1')
+        assert error.value.code == 503
+
+
+def test_fetcher_does_not_retry_client_errors():
+    with OAIServer([make_record(0)]) as server:
+        server.fail_token, server.fail_status = '1', 404
+        with pytest.raises(HTTPError):
+            Fetcher(backoff=10).open(f'{server.url}?verb=ListRecords&resumptionToken=1')
+        assert len(server.requests) == 1
+
+
+def test_harvest_over_one_connection(tmp_path):
+    with OAIServer([make_record(i) for i in range(25)], page_size=10) as server:
+        LidoRDFConverter('defaultMapping.x3ml').process_url(server.url, rdf_folder=tmp_path / 'rdf', suffix='nt')
+    assert len(server.requests) == 3
+    assert len(server.clients) == 1
+
+
+def test_convert_file_url():
+    converter = LidoRDFConverter('defaultMapping.x3ml')
+    graph = converter.process_url(Path('example1.xml').resolve().as_uri())
+    assert len(graph) == len(converter.parse_file('example1.xml')[0]) > 0
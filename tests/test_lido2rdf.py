@@ -1,4 +1,6 @@
 import sys
+import json
+import shutil
 import importlib
 from unittest.mock import MagicMock, patch
 from urllib.error import URLError
@@ -8,6 +10,13 @@ import pytest
 importlib.reload(lido2rdf)
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    '''Keeps the compiled mappings cache of CLI runs out of the home directory'''
+    monkeypatch.setenv('LIDO2RDF_CACHE', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+
 def test_cli_prints_help_when_stdin_is_tty(monkeypatch, capsys):
     '''Test that the CLI prints help message when stdin is a TTY'''
     monkeypatch.setattr(sys, "argv", ["lido2rdf"])
@@ -34,3 +43,79 @@ def test_cli_exits_and_prints_error_on_network_exception(monkeypatch, capsys):
         with pytest.raises(SystemExit) as excinfo:
             lido2rdf.cli_convert()
     assert excinfo.value.code == 1
+
+
+def test_cli_streams_ntriples_without_graph(monkeypatch, tmp_path):
+    target = tmp_path / "out.nt"
+    monkeypatch.setattr(sys, "argv", ["lido2rdf", "example1.xml", "-o", str(target), "-t", "nt"])
+    monkeypatch.setattr(sys.stdin, "isatty", lambda: False)
+    lido2rdf.cli_convert()
+    lines = target.read_text().splitlines()
+    assert len(lines) > 0
+    assert all(line.endswith(' .') for line in lines)
+
+
+def test_cli_writes_profile(monkeypatch, tmp_path):
+    profile = tmp_path / "profile.json"
+    monkeypatch.setattr(sys, "argv", ["lido2rdf", "example1.xml", "-o", str(tmp_path / "out.nt"), "-t", "nt",
+                                      "--profile", str(profile)])
+    monkeypatch.setattr(sys.stdin, "isatty", lambda: False)
+    lido2rdf.cli_convert()
+    rows = json.loads(profile.read_text())
+    assert rows == sorted(rows, key=lambda row: row['seconds'], reverse=True)
+    mappings = [row for row in rows if row['link'] is None]
+    assert all(row['calls'] == 1 for row in mappings)
+    assert sum(row['triples'] for row in mappings) >= sum(row['triples'] for row in rows if row['link'] is not None) > 0
+
+
+def test_batch_converts_directory_and_skips_up_to_date(tmp_path):
+    lido = tmp_path / "lido"
+    (lido / "sub").mkdir(parents=True)
+    shutil.copy("example1.xml", lido / "a.xml")
+    shutil.copy("example2.xml", lido / "sub" / "b.xml")
+    out = f"{tmp_path}/out/"
+    counts = lido2rdf.lido2rdf_batch([str(lido)], "defaultMapping.x3ml", out, "nt", "nt")
+    assert counts == {'converted': 2, 'skipped': 0, 'failed': 0}
+    assert (tmp_path / "out" / "a.nt").read_text() and (tmp_path / "out" / "sub" / "b.nt").read_text()
+    counts = lido2rdf.lido2rdf_batch([str(lido)], "defaultMapping.x3ml", out, "nt", "nt")
+    assert counts == {'converted': 0, 'skipped': 2, 'failed': 0}
+    counts = lido2rdf.lido2rdf_batch([str(lido)], "defaultMapping.x3ml", out, "nt", "nt", force=True, workers=2)
+    assert counts == {'converted': 2, 'skipped': 0, 'failed': 0}
+
+
+def test_cli_merges_list_and_glob(monkeypatch, tmp_path):
+    files = tmp_path / "files.txt"
+    files.write_text("# LIDO files\nexample1.xml\nmissing.xml\n")
+    target = tmp_path / "merged.nt"
+    monkeypatch.setattr(sys, "argv", ["lido2rdf", f"@{files}", "example[2].xml", "-o", str(target), "-t", "nt"])
+    with pytest.raises(SystemExit) as excinfo:
+        lido2rdf.cli_convert()
+    assert excinfo.value.code == 1
+    single = tmp_path / "single.nt"
+    monkeypatch.setattr(sys, "argv", ["lido2rdf", "example1.xml", "-o", str(single), "-t", "nt"])
+    lido2rdf.cli_convert()
+    assert set(single.read_text().splitlines()) < set(target.read_text().splitlines())
+
+
+def test_cli_does_not_expand_url_with_query(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["lido2rdf", "http://127.0.0.1:9/oai?set=x", "-m", "defaultMapping.x3ml"])
+    monkeypatch.setattr(sys.stdin, "isatty", lambda: False)
+    with patch("lido2rdf.lido2rdf", return_value=None) as mocked_converter:
+        lido2rdf.cli_convert()
+    assert mocked_converter.call_args.args[0] == "http://127.0.0.1:9/oai?set=x"
+
+
+def test_cli_fails_on_glob_without_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(sys, "argv", ["lido2rdf", str(tmp_path / "*.xml"), "-o", str(tmp_path / "out.nt")])
+    with pytest.raises(SystemExit) as excinfo:
+        lido2rdf.cli_convert()
+    assert excinfo.value.code == 1
+
+
+def test_cli_reports_foreign_checkpoint(monkeypatch, tmp_path, capsys):
+    rdf_folder = tmp_path / "rdf"
+    (tmp_path / "rdf.checkpoint.json").write_text(json.dumps({'server_url': 'http://other/oai', 'oai_cmd': 'ListRecords'}))
+    monkeypatch.setattr(sys, "argv", ["lido2rdf", "http://127.0.0.1:9/oai", "--resume", "--rdf-folder", str(rdf_folder)])
+    with pytest.raises(SystemExit) as excinfo:
+        lido2rdf.cli_convert()
+    assert excinfo.value.code == 1
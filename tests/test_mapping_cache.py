@@ -0,0 +1,73 @@
+from libs.mapping_cache import MappingCache, DiskCache, load_mappings
+import libs.x3ml as x3ml
+
+MAPPING = '''<x3ml><mappings><mapping>
+  <domain>
+    <source_node>lido:{tag}</source_node>
+    <target_node><entity><type>crm:E22_Human-Made_Object</type></entity></target_node>
+  </domain>
+</mapping></mappings></x3ml>'''
+
+
+def test_cache_hits_and_misses():
+    cache = MappingCache()
+    text = MAPPING.format(tag='object')
+    first = cache.get(text)
+    assert isinstance(first, x3ml.Mappings)
+    assert first[0].S.path == 'lido:object'
+    assert cache.get(text) is first
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_cache_evicts_least_recently_used_by_size():
+    texts = [MAPPING.format(tag=t) for t in ('a', 'b', 'c')]
+    cache = MappingCache(max_size=2 * len(texts[0]))
+    a = cache.get(texts[0])
+    cache.get(texts[1])
+    cache.get(texts[0])
+    cache.get(texts[2])  # evicts b
+    assert len(cache) == 2
+    assert cache.get(texts[0]) is a
+    misses = cache.misses
+    cache.get(texts[1])
+    assert cache.misses == misses + 1
+
+
+def test_cache_build_function_and_file(tmp_path):
+    cache = MappingCache()
+    built = cache.get('{"key": 1}', lambda: x3ml.Mappings())
+    assert len(built) == 0
+    p = tmp_path / 'm.x3ml'
+    p.write_text(MAPPING.format(tag='actor'))
+    first = cache.get_file(p)
+    assert cache.get_file(p) is first
+    assert cache.stats()['hits'] == 1
+
+
+def test_disk_cache_reuses_pickled_mappings(tmp_path, monkeypatch):
+    mapping_file = tmp_path / 'mapping.x3ml'
+    mapping_file.write_text(MAPPING.format(tag='object'))
+    first = load_mappings(mapping_file, tmp_path / 'cache')
+    assert len(list((tmp_path / 'cache').glob('*.pickle'))) == 1
+
+    def parse(*args):
+        raise AssertionError('mapping parsed again')
+    monkeypatch.setattr(x3ml.Mappings, 'from_str', parse)
+    warm = load_mappings(mapping_file, tmp_path / 'cache')
+    assert warm is not first and warm[0].S.path == 'lido:object'
+    assert warm[0].S._xpath is not None
+
+
+def test_disk_cache_rebuilds_changed_and_broken_entries(tmp_path):
+    mapping_file = tmp_path / 'mapping.x3ml'
+    cache = DiskCache(tmp_path / 'cache')
+    mapping_file.write_text(MAPPING.format(tag='object'))
+    cache.get_file(mapping_file)
+    mapping_file.write_text(MAPPING.format(tag='event'))
+    assert cache.get_file(mapping_file)[0].S.path == 'lido:event'
+    entries = list((tmp_path / 'cache').glob('*.pickle'))
+    assert len(entries) == 2
+    for entry in entries:
+        entry.write_bytes(b'broken')
+    assert cache.get_file(mapping_file)[0].S.path == 'lido:event'
@@ -0,0 +1,30 @@
+import pickle
+from libs.metrics import Metrics, NullMetrics
+from libs.LidoRDFConverter import LidoRDFConverter
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 5.0):
+        metrics.observe('xml_parse', seconds)
+    text = metrics.render()
+    assert 'lido2rdf_stage_seconds_bucket{stage="xml_parse",le="0.1"} 1' in text
+    assert 'lido2rdf_stage_seconds_bucket{stage="xml_parse",le="1.0"} 2' in text
+    assert 'lido2rdf_stage_seconds_bucket{stage="xml_parse",le="+Inf"} 3' in text
+    assert 'lido2rdf_stage_seconds_count{stage="xml_parse"} 3' in text
+
+
+def test_converter_reports_stages():
+    metrics = Metrics()
+    converter = LidoRDFConverter('defaultMapping.x3ml', metrics=metrics)
+    graph, _ = converter.parse_file('example2.xml')
+    assert metrics.stages['mapping_load'].counts != [0] * len(metrics.stages['mapping_load'].counts)
+    # Records are emitted to the graph, the graph is serialized once
+    assert (sum(metrics.stages['rdf_emit'].counts), sum(metrics.stages['rdf_serialize'].counts)) == (20, 0)
+    converter.serialize(graph, 'nt')
+    assert sum(metrics.stages['rdf_serialize'].counts) == 1
+    assert metrics.counters['records'] == 20
+    hits, misses = metrics.caches['id_node']
+    assert hits > 0 and misses > 0
+    # Worker processes get a converter without the registry
+    assert isinstance(pickle.loads(pickle.dumps(converter)).metrics, NullMetrics)
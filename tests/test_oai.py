@@ -0,0 +1,181 @@
+import io
+import pytest
+import json
+import threading
+from urllib.error import HTTPError
+from collections import namedtuple
+from libs.oai import resumption_token, prefetch, harvest, ChunkQueue, pump, PageReader, date_windows, partition_cmds
+from libs.http_fetch import Fetcher
+from libs.LidoRDFConverter import LidoRDFConverter, make_sink
+from tests.oai_server import OAIServer, make_record, LIDO_NS
+
+Args = namedtuple('Args', 'oai_from oai_to')
+
+
+def test_resumption_token():
+    page = b'<OAI-PMH><ListRecords><record/><resumptionToken completeListSize="25" cursor="10">a&amp;b</resumptionToken></ListRecords></OAI-PMH>'
+    assert resumption_token(page) == ('a&b', {'completeListSize': '25', 'cursor': '10'})
+    assert resumption_token(b'<oai:resumptionToken cursor="20"/>') == ('', {'cursor': '20'})
+    assert resumption_token(b'<OAI-PMH><ListRecords/></OAI-PMH>') == ('', {})
+
+
+def test_prefetch_keeps_order_and_raises():
+    assert list(prefetch(range(10), 2)) == list(range(10))
+
+    def failing():
+        yield 1
+        raise ValueError('boom')
+    with pytest.raises(ValueError):
+        list(prefetch(failing(), 1))
+
+
+def test_harvest_stages_run_concurrently():
+    written = []
+    assert harvest(iter(range(5)), lambda x: x * 2, written.append, depth=2) == 5
+    assert written == [0, 2, 4, 6, 8]
+
+
+def read_lines(folder):
+    return [line for f in sorted(folder.iterdir()) for line in f.read_text().splitlines()]
+
+
+@pytest.mark.parametrize('depth', [0, 2])
+def test_process_url_harvests_all_pages(tmp_path, depth):
+    records = [make_record(i) for i in range(25)]
+    converter = LidoRDFConverter('defaultMapping.x3ml')
+    out = io.StringIO()
+    converter.parse_string(f'<lido:lidoWrap xmlns:lido="{LIDO_NS}">{"".join(records)}</lido:lidoWrap>'.encode(),
+                           make_sink('nt', out))
+    with OAIServer(records, page_size=10) as server:
+        converter.process_url(server.url, rdf_folder=tmp_path / 'rdf', suffix='nt', prefetch=depth)
+    assert [q.get('resumptionToken') for q in server.requests] == [None, '10', '20']
+    assert len(list((tmp_path / 'rdf').iterdir())) == 3
+    assert sorted(read_lines(tmp_path / 'rdf')) == sorted(out.getvalue().splitlines())
+
+
+def test_chunk_queue_streams_and_raises():
+    stream = ChunkQueue(depth=2)
+    source = io.BytesIO(b'x' * 200_000)
+    thread = threading.Thread(target=pump, args=(PageReader(source), stream))
+    thread.start()
+    assert len(stream.read(1000)) == 1000
+    assert len(stream.read()) == 199_000
+    assert stream.read(10) == b''
+    thread.join()
+    failing = ChunkQueue()
+    failing.put(b'abc')
+    failing.put(OSError('reset'))
+    assert failing.read(2) == b'ab'
+    assert failing.read(2) == b'c'
+    with pytest.raises(OSError):
+        failing.read(2)
+
+
+def test_process_url_tees_pages_to_spool(tmp_path):
+    records = [make_record(i) for i in range(15)]
+    with OAIServer(records, page_size=10) as server:
+        LidoRDFConverter('defaultMapping.x3ml').process_url(server.url, rdf_folder=tmp_path / 'rdf', suffix='nt',
+                                                           spool=tmp_path / 'spool')
+        pages = [server.page({}), server.page({'resumptionToken': '10'})]
+    [run] = (tmp_path / 'spool').iterdir()
+    assert [p.read_bytes() for p in sorted(run.iterdir())] == pages
+
+
+@pytest.mark.parametrize('depth', [0, 2])
+def test_process_url_resumes_from_checkpoint(tmp_path, depth):
+    records = [make_record(i) for i in range(35)]
+    rdf_folder = tmp_path / 'rdf'
+    converter = LidoRDFConverter('defaultMapping.x3ml')
+    with OAIServer(records, page_size=10) as server:
+        server.fail_token = '20'
+        with pytest.raises(HTTPError):
+            converter.process_url(server.url, rdf_folder=rdf_folder, suffix='nt', prefetch=depth, fetcher=Fetcher(retries=0))
+        checkpoint = json.loads((tmp_path / 'rdf.checkpoint.json').read_text())
+        assert (checkpoint['index'], checkpoint['token'], checkpoint['cursor']) == (1, '20', '10')
+        assert checkpoint['complete_list_size'] == '35' and not checkpoint['done']
+        assert len(list(rdf_folder.iterdir())) == 2
+        server.fail_token = None
+        server.requests.clear()
+        converter.process_url(server.url, rdf_folder=rdf_folder, suffix='nt', prefetch=depth, resume=True)
+        assert [q.get('resumptionToken') for q in server.requests] == ['20', '30']
+        assert json.loads((tmp_path / 'rdf.checkpoint.json').read_text())['done']
+        converter.process_url(server.url, rdf_folder=rdf_folder, suffix='nt', prefetch=depth, resume=True)
+        assert len(server.requests) == 2
+    assert sorted(f.name for f in rdf_folder.iterdir()) == [f'lido_records_{i:05d}.nt' for i in range(4)]
+    assert len(set(read_lines(rdf_folder))) == len(read_lines(rdf_folder))
+
+
+def test_process_url_harvests_incrementally(tmp_path):
+    records = [make_record(i) for i in range(25)]
+    state = tmp_path / 'state.json'
+    converter = LidoRDFConverter('defaultMapping.x3ml')
+    with OAIServer(records, page_size=10) as server:
+        server.datestamps = {0: '2024-02-01T00:00:00Z'}
+        converter.process_url(server.url, rdf_folder=tmp_path / 'rdf', suffix='nt', state=state)
+        [endpoint] = json.loads(state.read_text()).values()
+        assert endpoint['datestamp'] == '2024-02-01T00:00:00Z'
+        server.datestamps.update({3: '2024-02-02T00:00:00Z', 7: '2024-03-01T00:00:00Z'})
+        server.deleted = {7}
+        server.requests.clear()
+        converter.process_url(server.url, rdf_folder=tmp_path / 'rdf', suffix='nt', state=state)
+        # from is inclusive, records of the latest datestamp are harvested again
+        assert [q.get('from') for q in server.requests] == ['2024-02-01T00:00:00Z']
+    # Each harvest has a folder of its own
+    full, delta = tmp_path / 'rdf' / 'full', tmp_path / 'rdf' / 'since-2024-02-01T00-00-00Z'
+    assert sorted(f.name for f in (tmp_path / 'rdf').iterdir() if f.is_dir()) == [full.name, delta.name]
+    assert len(list(full.glob('*.nt'))) == 3
+    assert sorted(f.name for f in delta.iterdir()) == ['lido_records_00000.deleted.jsonl', 'lido_records_00000.nt']
+    assert 'rec-3' in (delta / 'lido_records_00000.nt').read_text()
+    tombstones = (delta / 'lido_records_00000.deleted.jsonl').read_text().splitlines()
+    assert [json.loads(t) for t in tombstones] == [{'identifier': 'rec-7', 'datestamp': '2024-03-01T00:00:00Z', 'deleted': True}]
+    assert list(json.loads(state.read_text()).values())[0]['datestamp'] == '2024-03-01T00:00:00Z'
+
+
+def test_date_windows():
+    assert date_windows('2024-01-01', '2024-01-10T12:00:00Z', 3) == [
+        ('2024-01-01', '2024-01-03'), ('2024-01-04', '2024-01-06'), ('2024-01-07', '2024-01-10')]
+    assert date_windows('2024-01-01T00:00:00Z', '2024-01-01T00:00:01Z', 5) == [
+        ('2024-01-01T00:00:00Z', '2024-01-01T00:00:00Z'), ('2024-01-01T00:00:01Z', '2024-01-01T00:00:01Z')]
+
+
+def test_partition_cmds():
+    cmds = partition_cmds('ListRecords&from=2020-01-01&metadataPrefix=lido', ['coins:gold', 'art'],
+                          [('2024-01-01', '2024-01-03'), ('2024-01-04', '2024-01-06')])
+    assert list(cmds) == ['set-coins_gold_window-000', 'set-coins_gold_window-001', 'set-art_window-000', 'set-art_window-001']
+    assert cmds['set-art_window-001'] == 'ListRecords&metadataPrefix=lido&set=art&from=2024-01-04&until=2024-01-06'
+    assert partition_cmds('ListRecords&metadataPrefix=lido', ['art']) == {'set-art': 'ListRecords&metadataPrefix=lido&set=art'}
+
+
+def full_conversion(records):
+    out = io.StringIO()
+    LidoRDFConverter('defaultMapping.x3ml').parse_string(
+        f'<lido:lidoWrap xmlns:lido="{LIDO_NS}">{"".join(records)}</lido:lidoWrap>'.encode(), make_sink('nt', out))
+    return sorted(out.getvalue().splitlines())
+
+
+def partition_lines(folder):
+    return sorted(line for f in folder.glob('*/*.nt') for line in f.read_text().splitlines())
+
+
+def test_process_url_harvests_sets_in_parallel(tmp_path):
+    records = [make_record(i) for i in range(30)]
+    with OAIServer(records, page_size=5, delay=0.05) as server:
+        server.sets = {'even': set(range(0, 30, 2)), 'odd': set(range(1, 30, 2))}
+        LidoRDFConverter('defaultMapping.x3ml').process_url(
+            server.url, rdf_folder=tmp_path / 'rdf', suffix='nt', sets=['even', 'odd'], streams=2,
+            fetcher=Fetcher(host_limit=1))
+    assert server.max_active == 1
+    assert sorted(p.name for p in (tmp_path / 'rdf').iterdir() if p.is_dir()) == ['set-even', 'set-odd']
+    assert partition_lines(tmp_path / 'rdf') == full_conversion(records)
+
+
+def test_process_url_splits_date_windows(tmp_path):
+    records = [make_record(i) for i in range(30)]
+    with OAIServer(records, page_size=4) as server:
+        server.datestamps = {i: f'2024-01-{i + 1:02d}T12:00:00Z' for i in range(30)}
+        LidoRDFConverter('defaultMapping.x3ml').process_url(
+            server.url, rdf_folder=tmp_path / 'rdf', suffix='nt', split=3, streams=3, args=Args('', '2024-01-30T12:00:00Z'))
+        windows = sorted((q['from'], q['until']) for q in server.requests if 'from' in q)
+    assert windows == [('2024-01-01T12:00:00Z', '2024-01-11T03:59:59Z'), ('2024-01-11T04:00:00Z', '2024-01-20T19:59:59Z'),
+                       ('2024-01-20T20:00:00Z', '2024-01-30T12:00:00Z')]
+    assert partition_lines(tmp_path / 'rdf') == full_conversion(records)
@@ -1,6 +1,8 @@
+import time
 import hashlib
 from lxml import etree
 import libs.x3ml as x3ml
+from benchmarks.lido_corpus import generate
 
 LIDO_NS = x3ml.used_namespaces['lido']
 XML_NS = x3ml.used_namespaces['xml']
@@ -221,3 +223,89 @@ def test_find_var_no_entity_returns_empty():
     # link without the expected path should return the default empty string
     link = etree.Element("link")
     assert x3ml.find_var(link) == ""
+
+
+def test_compiled_mappings_match_string_xpaths():
+    mappings = x3ml.Mappings.from_file('defaultMapping.x3ml')
+    plain = x3ml.Mappings.from_file('defaultMapping.x3ml', compiled=False)
+    assert mappings.mappings == plain.mappings
+    assert all(m.S._xpath is not None for m in mappings)
+    assert all(m.S._xpath is None for m in plain)
+    record = etree.parse('defaultLido.xml').getroot()
+    for m, p in zip(mappings, plain):
+        assert len(m.S.subs(record)) == len(p.S.subs(record))
+        for po, po_plain in zip(m.POs, p.POs):
+            assert po.O.subs(record) == po_plain.O.subs(record)
+            assert po.isValid(record) == po_plain.isValid(record)
+
+
+def test_condition_compile_is_reset_by_add():
+    xml = f'<e xmlns:lido="{LIDO_NS}"><lido:name>keep</lido:name></e>'
+    elem = etree.fromstring(xml.encode('utf-8'))
+    cond = x3ml.Condition()
+    cond.add('lido:name/text()', 'drop')
+    cond.compile()
+    assert cond.isValid(elem) is False
+    cond.add('lido:name/text()', 'keep')
+    assert cond._xpath is None
+    assert cond.compile().isValid(elem) is True
+
+
+def test_mappings_from_model_match_xml_route():
+    from libs.x3ml_classes import X3ml, loadX3ml
+    model = loadX3ml('defaultMapping.x3ml')
+    xml_route = x3ml.Mappings.from_str(model.to_str())
+    assert len(xml_route) > 0
+    assert x3ml.Mappings.from_model(model).mappings == xml_route.mappings
+    json_model = X3ml.fromJSON(model.toJSON())
+    assert x3ml.Mappings.from_model(json_model).mappings == xml_route.mappings
+    model.mappings[0].skip = True
+    model.mappings[1].links[0].skip = True
+    assert x3ml.Mappings.from_model(model).mappings == x3ml.Mappings.from_str(model.to_str()).mappings
+
+
+def test_path_index_and_local_ids():
+    xml = f'''
+    <root xmlns:lido="{LIDO_NS}">
+      <lido:set><lido:event><lido:name>a</lido:name></lido:event><lido:event><lido:name>b</lido:name></lido:event></lido:set>
+      <lido:set><lido:event><lido:name>c</lido:name></lido:event></lido:set>
+    </root>'''
+    root = etree.fromstring(xml.encode('utf-8'))
+    index = x3ml.path_index(root)
+    events = root.findall(f'.//{{{LIDO_NS}}}event')
+    assert [index[e][:2] for e in events] == [("root/set/event", 1), ("root/set/event", 2), ("root/set/event", 1)]
+    assert index[events[0]][0] is index[events[2]][0]  # interned
+    assert index[events[2]][2] == "root/set[2]/event[1]"
+    record = x3ml.Record(root=root)
+    infos = [x3ml.Info.from_elem(e, index=0, record=record) for e in events]
+    assert {info.id for info in infos} == {"root/set/event/0"}
+    record = x3ml.Record(root=root, id_scheme='v2')
+    infos = [x3ml.Info.from_elem(e, index=0, record=record) for e in events]
+    assert len({info.id for info in infos}) == 3
+    assert all(e.get('n4o_id') is None for e in events)
+
+
+def local_ids(data: list) -> list:
+    return [info.id for d in data for info in [d.info] + [i for po in d.po_data_list for i in po.infos]
+            if info.mode == x3ml.IDMode.LOCAL_ID]
+
+
+def evaluate_corpus(records: int):
+    '''Evaluates the mappings on the records of a corpus without a record, returns the seconds and the local IDs'''
+    xml = f'<lido:lidoWrap xmlns:lido="{LIDO_NS}">{"".join(generate(records))}</lido:lidoWrap>'.encode()
+    mappings = x3ml.Mappings.from_file('defaultMapping.x3ml')
+    start = time.perf_counter()
+    ids = [local_ids(m.evaluate(lido)) for lido in etree.fromstring(xml) for m in mappings]
+    seconds = time.perf_counter() - start
+    # Like the converter, which evaluates the mappings with a record rooted at the lido:lido
+    expected = [local_ids(m.evaluate(lido, x3ml.Record(root=lido))) for lido in etree.fromstring(xml) for m in mappings]
+    return seconds, ids, expected
+
+
+def test_evaluate_without_record():
+    seconds, ids, expected = evaluate_corpus(10)
+    assert ids == expected and any(ids)
+    assert all(i.startswith('lidoWrap/lido/') for i in sum(ids, []))
+    more_seconds, _, _ = evaluate_corpus(40)
+    # Linear in the number of records
+    assert more_seconds < 8 * seconds